@@ -0,0 +1,246 @@
+import functools
+import logging
+import os
+import pickle
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from hashlib import sha1
+from typing import Any, Callable
+
+import metrics
+
+logger = logging.getLogger()
+
+CACHE_DIR = "cache"
+DAY = 24 * 3600  # s
+MAX_DISK_SIZE = 200 * 1024 * 1024  # bytes
+
+
+@dataclass(frozen=True)
+class CacheEntry:
+    created: float  # timestamp
+    value: Any
+
+
+class _Flight:
+    """A computation in progress that other callers can wait for."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error: BaseException | None = None
+
+
+class TieredCache:
+    """
+    Two tier cache: an in-memory LRU in front of pickle files in a directory.
+    Concurrent misses of a key run a single computation, entries that are
+    expired but within stale_ttl are served while they are refreshed in the
+    background, and the directory is kept under max_disk_size evicting the
+    oldest files.
+    """
+
+    def __init__(
+        self,
+        name: str = "cache",
+        ttl: float = DAY,
+        stale_ttl: float = DAY,
+        memory_size: int = 128,
+        cache_dir: str = CACHE_DIR,
+        max_disk_size: int = MAX_DISK_SIZE,
+    ):
+        self.name = name
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.memory_size = memory_size
+        self.cache_dir = cache_dir
+        self.max_disk_size = max_disk_size
+
+        self._memory: OrderedDict[str, CacheEntry] = OrderedDict()
+        self._flights: dict[str, _Flight] = {}
+        self._lock = threading.Lock()
+
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def get(self, key: str, compute: Callable[[], Any]) -> Any:
+        entry = self._get_memory(key)
+        result = "memory_hit"
+        if entry is None:
+            entry = self._get_disk(key)
+            result = "disk_hit"
+            if entry is not None:
+                self._set_memory(key, entry)
+
+        if entry is not None:
+            age = time.time() - entry.created
+            if age < self.ttl:
+                metrics.CACHE_REQUESTS.inc(cache=self.name, result=result)
+                return entry.value
+            if age < self.ttl + self.stale_ttl:
+                metrics.CACHE_REQUESTS.inc(cache=self.name, result="stale_hit")
+                self._refresh_in_background(key, compute)
+                return entry.value
+
+        metrics.CACHE_REQUESTS.inc(cache=self.name, result="miss")
+
+        try:
+            return self._compute(key, compute)
+        except Exception:
+            # Better an outdated value than no value at all
+            if entry is None:
+                raise
+            logger.exception(f"Unable to refresh the cache entry {key}, serving the stale value")
+            return entry.value
+
+    def invalidate(self, key: str):
+        with self._lock:
+            self._memory.pop(key, None)
+        try:
+            os.remove(os.path.join(self.cache_dir, key))
+        except FileNotFoundError:
+            pass
+
+    def _get_memory(self, key: str) -> CacheEntry | None:
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                self._memory.move_to_end(key)
+            return entry
+
+    def _set_memory(self, key: str, entry: CacheEntry):
+        with self._lock:
+            self._memory[key] = entry
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_size:
+                self._memory.popitem(last=False)
+
+    def _get_disk(self, key: str) -> CacheEntry | None:
+        cache_path = os.path.join(self.cache_dir, key)
+        try:
+            created = os.path.getmtime(cache_path)
+            with open(cache_path, "rb") as f:
+                return CacheEntry(created=created, value=pickle.load(f))
+        except FileNotFoundError:
+            return None
+        except Exception:
+            logger.warning(f"Discarding the unreadable cache file {cache_path}", exc_info=True)
+            return None
+
+    def _set_disk(self, key: str, value: Any):
+        # Write to a temporary file and move it, readers never see partial files
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                pickle.dump(value, f)
+            os.replace(tmp_path, os.path.join(self.cache_dir, key))
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        self._evict_disk()
+
+    def _evict_disk(self):
+        files = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.is_file() and not entry.name.startswith(".tmp-"):
+                stat = entry.stat()
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+
+        disk_size = sum(size for _, size, _ in files)
+        # Remove the oldest files first
+        for _, size, path in sorted(files):
+            if disk_size <= self.max_disk_size:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            disk_size -= size
+
+    def _compute(self, key: str, compute: Callable[[], Any]) -> Any:
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+
+        try:
+            flight.value = compute()
+            self._set_memory(key, CacheEntry(created=time.time(), value=flight.value))
+            try:
+                self._set_disk(key, flight.value)
+            except Exception:
+                logger.exception(f"Unable to write the cache entry {key} to disk")
+            return flight.value
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+
+    def _refresh_in_background(self, key: str, compute: Callable[[], Any]):
+        with self._lock:
+            if key in self._flights:
+                return
+
+        def refresh():
+            try:
+                self._compute(key, compute)
+            except Exception:
+                logger.exception(f"Unable to refresh the cache entry {key}")
+
+        threading.Thread(target=refresh, name=f"cache-refresh-{key[:8]}", daemon=True).start()
+
+
+def get_cache_key(func: Callable, args: tuple, kwargs: dict) -> str:
+    return sha1(
+        (
+            str(func.__module__) + str(func.__name__) +
+            str(args) + str(kwargs)
+        ).encode("utf-8")
+    ).hexdigest()
+
+
+def cached(
+    ttl: float = DAY,
+    stale_ttl: float = DAY,
+    memory_size: int = 128,
+    cache_dir: str = CACHE_DIR,
+    max_disk_size: int = MAX_DISK_SIZE,
+):
+    """
+    Caches the results of a function in a TieredCache, keyed by its
+    arguments. The cache is available as the `cache` attribute of the
+    decorated function.
+    """
+
+    def decorator(func):
+        cache = TieredCache(
+            name=func.__name__,
+            ttl=ttl,
+            stale_ttl=stale_ttl,
+            memory_size=memory_size,
+            cache_dir=cache_dir,
+            max_disk_size=max_disk_size,
+        )
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            cache_key = get_cache_key(func, args, kwargs)
+            return cache.get(cache_key, lambda: func(*args, **kwargs))
+
+        wrapper.cache = cache
+        wrapper.cache_key = lambda *args, **kwargs: get_cache_key(func, args, kwargs)
+        return wrapper
+
+    return decorator
@@ -0,0 +1,134 @@
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable, TypeVar
+
+logger = logging.getLogger()
+
+T = TypeVar("T")
+
+# Worker processes of the compute pool, with 0 the jobs run in the calling thread
+COMPUTE_WORKERS = int(os.environ.get("COMPUTE_WORKERS", 0))
+# Jobs that can wait for a free worker before new ones are rejected
+COMPUTE_QUEUE_SIZE = int(os.environ.get("COMPUTE_QUEUE_SIZE", 4))
+# Seconds suggested to the clients to retry a rejected job
+COMPUTE_RETRY_AFTER = int(os.environ.get("COMPUTE_RETRY_AFTER", 5))
+
+
+class ComputeBusy(Exception):
+    """Raised when the compute pool can not admit more jobs."""
+
+
+class ComputeFailed(Exception):
+    """Raised when a worker of the compute pool died while running a job."""
+
+
+_pool: ProcessPoolExecutor | None = None
+_pool_lock = threading.Lock()
+_slots = threading.BoundedSemaphore(
+    max(COMPUTE_WORKERS, 1) + COMPUTE_QUEUE_SIZE)
+
+
+def get_pool() -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            logger.info(f"Starting the compute pool with {COMPUTE_WORKERS} workers")
+            # Spawn the workers, forking a process with running threads is unsafe
+            _pool = ProcessPoolExecutor(
+                max_workers=COMPUTE_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _pool
+
+
+def reset_pool(pool: ProcessPoolExecutor):
+    """Replaces a broken pool, the next job starts a new one."""
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            logger.error("A compute worker died, restarting the compute pool")
+            _pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def run(func: Callable[..., T], *args) -> T:
+    """
+    Runs a CPU bound job, in the compute pool when it is enabled, and waits
+    for its result. Only a bounded number of jobs are admitted at the same time
+    so a burst of uploads can not starve the rest of the endpoints.
+    Raises:
+        ComputeBusy: All the workers are busy and the queue is full
+        ComputeFailed: The worker running the job died
+    """
+
+    if not _slots.acquire(blocking=False):
+        raise ComputeBusy()
+
+    try:
+        if COMPUTE_WORKERS <= 0:
+            return func(*args)
+        pool = get_pool()
+        try:
+            return pool.submit(func, *args).result()
+        except BrokenProcessPool as e:
+            reset_pool(pool)
+            raise ComputeFailed() from e
+    finally:
+        _slots.release()
+
+
+def run_many(func: Callable[..., T], args_list: list[tuple]) -> list[T]:
+    """
+    Runs several CPU bound jobs, in parallel in the compute pool when it is
+    enabled, and waits for all their results. Every job takes an admission
+    slot like the jobs of run, and at most one job per worker of the batch
+    is in flight at a time, so a batch can not flood the pool queue.
+    Raises:
+        ComputeBusy: All the workers are busy and the queue is full
+        ComputeFailed: A worker died running one of the jobs
+    """
+
+    if not args_list:
+        return []
+    # The batch is rejected when it can not start, later jobs wait for a slot
+    if not _slots.acquire(blocking=False):
+        raise ComputeBusy()
+
+    if COMPUTE_WORKERS <= 0:
+        try:
+            return [func(*args) for args in args_list]
+        finally:
+            _slots.release()
+
+    pool = get_pool()
+    in_flight = threading.Semaphore(COMPUTE_WORKERS)
+
+    def release(_):
+        _slots.release()
+        in_flight.release()
+
+    futures = []
+    try:
+        for i, args in enumerate(args_list):
+            in_flight.acquire()
+            if i > 0:
+                _slots.acquire()
+            try:
+                future = pool.submit(func, *args)
+            except BaseException:
+                release(None)
+                raise
+            future.add_done_callback(release)
+            futures.append(future)
+        return [future.result() for future in futures]
+    except BrokenProcessPool as e:
+        reset_pool(pool)
+        raise ComputeFailed() from e
+    finally:
+        # Nothing waits for the rest of the jobs after a failure
+        for future in futures:
+            future.cancel()
@@ -0,0 +1,89 @@
+"""
+Compact storage format of the energy data documents.
+
+The tariff names are stored once and the costs of every period (the months
+followed by the whole period) against every tariff as a compressed float64
+matrix. The rankings and the tariff_cost_diff are derived again on read, so
+the decoded documents have the same shape as the /file-upload responses. The
+costs of the re-pricing jobs are stored apart, in "repriced" (see repricing).
+"""
+
+import zlib
+
+import numpy as np
+from bson.binary import Binary
+
+FORMAT_VERSION = 2
+
+CONSUMPTION_FIELDS = ("consumption_p1", "consumption_p2", "consumption_p3", "num_days")
+PERIOD_FIELDS = ("first_day", "last_day", "th_rd_10_threshold")
+
+
+def encode_costs(costs: np.ndarray) -> Binary:
+    return Binary(zlib.compress(np.ascontiguousarray(costs, dtype="<f8").tobytes()))
+
+
+def decode_costs(costs: bytes, num_periods: int, num_tariffs: int) -> np.ndarray:
+    return np.frombuffer(zlib.decompress(costs), dtype="<f8").reshape(num_periods, num_tariffs)
+
+
+def encode_energy_data(energy_data: dict) -> dict:
+    periods = energy_data["monthly_data"] + [energy_data["all"]]
+    tariff_names = [tariff["name"] for tariff in energy_data["all"]["tariffs"]]
+    tariff_index = {name: i for i, name in enumerate(tariff_names)}
+
+    costs = np.empty((len(periods), len(tariff_names)), dtype=np.float64)
+    for i, period in enumerate(periods):
+        for tariff in period["tariffs"]:
+            costs[i, tariff_index[tariff["name"]]] = tariff["tariff_cost"]
+
+    document = {
+        key: value for key, value in energy_data.items()
+        if key not in ("monthly_data", "all")
+    }
+    document["format"] = FORMAT_VERSION
+    document["tariff_names"] = tariff_names
+    document["periods"] = {
+        **{field: [period["consumption_data"][field] for period in periods]
+           for field in CONSUMPTION_FIELDS},
+        **{field: [period[field] for period in periods] for field in PERIOD_FIELDS},
+        "tariff_costs": encode_costs(costs),
+    }
+    return document
+
+
+def decode_periods(tariff_names: list[str], periods: dict) -> list[dict]:
+    num_periods = len(periods["num_days"])
+    costs = decode_costs(periods["tariff_costs"], num_periods, len(tariff_names))
+    rankings = np.argsort(costs, axis=1, kind="stable")
+
+    periods_data = []
+    for i, (period_costs, ranking) in enumerate(zip(costs.tolist(), rankings.tolist())):
+        best_tariff_cost = period_costs[ranking[0]]
+        periods_data.append({
+            "consumption_data": {field: periods[field][i] for field in CONSUMPTION_FIELDS},
+            "tariffs": [
+                {"name": tariff_names[tariff_index],
+                 "tariff_cost": period_costs[tariff_index],
+                 "tariff_cost_diff": period_costs[tariff_index] - best_tariff_cost}
+                for tariff_index in ranking
+            ],
+            **{field: periods[field][i] for field in PERIOD_FIELDS},
+        })
+    return periods_data
+
+
+def decode_energy_data(document: dict) -> dict:
+    # Documents stored before the compact format are already expanded
+    if document.get("format") != FORMAT_VERSION:
+        return dict(document)
+
+    periods_data = decode_periods(document["tariff_names"], document["periods"])
+
+    energy_data = {
+        key: value for key, value in document.items()
+        if key not in ("format", "tariff_names", "periods", "repriced")
+    }
+    energy_data["monthly_data"] = periods_data[:-1]
+    energy_data["all"] = periods_data[-1]
+    return energy_data
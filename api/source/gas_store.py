@@ -0,0 +1,293 @@
+import logging
+import os
+import sqlite3
+import threading
+from datetime import date, datetime
+
+import numpy as np
+import pandas as pd
+from utils import GasDataConsumption
+
+logger = logging.getLogger()
+
+GAS_DB_FILE = os.environ.get("GAS_DB_FILE", "../data/measurements.sqlite3")
+# Pickle with all the measurements used before the SQLite store
+LEGACY_DATA_FILE = "../data/measurements"
+
+
+class MeasurementError(Exception):
+    """Raised when a measurement is lower than the previous one of the user."""
+
+    def __init__(self, previous_measurement: float):
+        super().__init__(
+            f"Measurement is lower than previous value: {previous_measurement} m3")
+        self.previous_measurement = previous_measurement
+
+
+class GasMeasurementsStore:
+    """
+    Append only store of the gas meter readings, unique by (user_id, datetime).
+    Each thread uses its own connection, and the appends of all the threads and
+    processes are serialized by SQLite.
+    """
+
+    def __init__(self, path: str = GAS_DB_FILE):
+        self.path = path
+        self._local = threading.local()
+
+        with self._connection() as connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("""
+                CREATE TABLE IF NOT EXISTS measurements (
+                    user_id INTEGER NOT NULL,
+                    datetime TEXT NOT NULL,
+                    measurement REAL NOT NULL
+                )""")
+            # One reading per user and time. The stores created before the
+            # index was unique keep only the first copy of the repeated readings
+            if connection.execute(
+                    "SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = ?",
+                    ("measurements_user_datetime_unique",)).fetchone() is None:
+                connection.execute("""
+                    DELETE FROM measurements WHERE rowid NOT IN (
+                        SELECT MIN(rowid) FROM measurements GROUP BY user_id, datetime)""")
+                connection.execute("DROP INDEX IF EXISTS measurements_user_datetime")
+                connection.execute("""
+                    CREATE UNIQUE INDEX measurements_user_datetime_unique
+                    ON measurements (user_id, datetime)""")
+            # First and last reading of each user and day, kept up to date on
+            # every append. Any window of whole days is answered from them.
+            connection.execute("""
+                CREATE TABLE IF NOT EXISTS daily_rollups (
+                    user_id INTEGER NOT NULL,
+                    day TEXT NOT NULL,
+                    first_datetime TEXT NOT NULL,
+                    first_measurement REAL NOT NULL,
+                    last_datetime TEXT NOT NULL,
+                    last_measurement REAL NOT NULL,
+                    PRIMARY KEY (user_id, day)
+                )""")
+
+    # Keeps the earliest reading as the first one and the latest as the last
+    # one, whatever the order the readings are appended in
+    UPSERT_DAILY_ROLLUP = """
+        INSERT INTO daily_rollups VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT (user_id, day) DO UPDATE SET
+            first_measurement = CASE WHEN excluded.first_datetime < first_datetime
+                THEN excluded.first_measurement ELSE first_measurement END,
+            first_datetime = MIN(first_datetime, excluded.first_datetime),
+            last_measurement = CASE WHEN excluded.last_datetime >= last_datetime
+                THEN excluded.last_measurement ELSE last_measurement END,
+            last_datetime = MAX(last_datetime, excluded.last_datetime)"""
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    @staticmethod
+    def _format_time(time: datetime) -> str:
+        # Fixed width so the text order is the chronological order
+        return time.isoformat(sep=" ", timespec="microseconds")
+
+    @classmethod
+    def _daily_rollup(cls, user_id: int, time: str, measurement: float) -> tuple:
+        return (user_id, time[:10], time, measurement, time, measurement)
+
+    def append(self, user_id: int, time: datetime, measurement: float):
+        """
+        Raises:
+            MeasurementError: The measurement is lower than the previous one
+        """
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            previous = connection.execute(
+                "SELECT measurement FROM measurements WHERE user_id = ? ORDER BY datetime DESC LIMIT 1",
+                (user_id,),
+            ).fetchone()
+            if previous is not None and previous[0] > measurement:
+                raise MeasurementError(previous[0])
+
+            time = self._format_time(time)
+            connection.execute(
+                "INSERT INTO measurements (user_id, datetime, measurement) VALUES (?, ?, ?)",
+                (user_id, time, measurement),
+            )
+            connection.execute(
+                self.UPSERT_DAILY_ROLLUP, self._daily_rollup(user_id, time, measurement))
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+
+    def append_many(self, user_id: int, measurements: pd.DataFrame) -> int:
+        """
+        Appends a series of readings, sorted by time, in one transaction. The
+        readings already stored are skipped, so a file can be imported again.
+        Returns:
+            The number of readings appended
+        Raises:
+            MeasurementError: The readings, together with the ones already
+                stored, decrease
+            ValueError: There are different readings at the same time
+        """
+        if measurements.empty:
+            return 0
+
+        readings: dict[str, float] = {}
+        for time, value in zip(measurements.index.to_pydatetime(), measurements.Measurement.tolist()):
+            time = self._format_time(time)
+            if readings.setdefault(time, value) != value:
+                raise ValueError(f"Different measurements at {time}")
+        first_time, last_time = min(readings), max(readings)
+
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            stored = dict(connection.execute(
+                "SELECT datetime, measurement FROM measurements "
+                "WHERE user_id = ? AND datetime >= ? AND datetime <= ?",
+                (user_id, first_time, last_time),
+            ).fetchall())
+            for time, value in readings.items():
+                if stored.get(time, value) != value:
+                    raise ValueError(f"A different measurement is already stored at {time}")
+            appended = sorted((time, value) for time, value in readings.items() if time not in stored)
+
+            # The whole series must keep increasing, with the readings already
+            # stored in between and around the imported ones
+            previous = connection.execute(
+                "SELECT measurement FROM measurements WHERE user_id = ? AND datetime < ? "
+                "ORDER BY datetime DESC LIMIT 1",
+                (user_id, first_time),
+            ).fetchall()
+            following = connection.execute(
+                "SELECT measurement FROM measurements WHERE user_id = ? AND datetime > ? "
+                "ORDER BY datetime LIMIT 1",
+                (user_id, last_time),
+            ).fetchall()
+            series = ([measurement for measurement, in previous]
+                      + [value for _, value in sorted({**stored, **readings}.items())]
+                      + [measurement for measurement, in following])
+            decreasing = np.flatnonzero(np.diff(series) < 0)
+            if len(decreasing):
+                raise MeasurementError(series[decreasing[0]])
+
+            connection.executemany(
+                "INSERT INTO measurements (user_id, datetime, measurement) VALUES (?, ?, ?)",
+                [(user_id, time, value) for time, value in appended],
+            )
+            connection.executemany(
+                self.UPSERT_DAILY_ROLLUP,
+                [self._daily_rollup(user_id, time, value) for time, value in appended],
+            )
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        return len(appended)
+
+    def _to_dataframe(self, rows: list[tuple[str, float]]) -> pd.DataFrame:
+        df = pd.DataFrame(rows, columns=["Datetime", "Measurement"])
+        df.Datetime = pd.to_datetime(df.Datetime)
+        return df.set_index("Datetime")
+
+    def get_last_readings(self, user_id: int, count: int) -> list[GasDataConsumption]:
+        rows = self._connection().execute(
+            "SELECT datetime, measurement FROM measurements WHERE user_id = ? ORDER BY datetime DESC LIMIT ?",
+            (user_id, count),
+        ).fetchall()
+        return [
+            GasDataConsumption(measurement=measurement, time=datetime.fromisoformat(time))
+            for time, measurement in reversed(rows)
+        ]
+
+    def get_window_readings(
+        self, user_id: int, first_day: date, last_day: date
+    ) -> tuple[GasDataConsumption, GasDataConsumption] | None:
+        """
+        First and last readings of the user from the start of first_day to the
+        end of last_day, looked up in the daily rollups.
+        """
+        connection = self._connection()
+        first = connection.execute(
+            "SELECT first_datetime, first_measurement FROM daily_rollups "
+            "WHERE user_id = ? AND day >= ? AND day <= ? ORDER BY day LIMIT 1",
+            (user_id, first_day.isoformat(), last_day.isoformat()),
+        ).fetchone()
+        if first is None:
+            return None
+        last = connection.execute(
+            "SELECT last_datetime, last_measurement FROM daily_rollups "
+            "WHERE user_id = ? AND day >= ? AND day <= ? ORDER BY day DESC LIMIT 1",
+            (user_id, first_day.isoformat(), last_day.isoformat()),
+        ).fetchone()
+        return (
+            GasDataConsumption(measurement=first[1], time=datetime.fromisoformat(first[0])),
+            GasDataConsumption(measurement=last[1], time=datetime.fromisoformat(last[0])),
+        )
+
+    def rebuild_rollups(self):
+        """Builds the daily rollups of the measurements stored without them."""
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            if connection.execute("SELECT 1 FROM daily_rollups LIMIT 1").fetchone() is None:
+                rows = connection.execute(
+                    "SELECT user_id, datetime, measurement FROM measurements").fetchall()
+                connection.executemany(
+                    self.UPSERT_DAILY_ROLLUP, [self._daily_rollup(*row) for row in rows])
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+
+    def get_measurements(self, user_id: int, start: datetime, end: datetime) -> pd.DataFrame:
+        """Measurements of the user between start and end, both included."""
+        rows = self._connection().execute(
+            "SELECT datetime, measurement FROM measurements "
+            "WHERE user_id = ? AND datetime >= ? AND datetime <= ? ORDER BY datetime",
+            (user_id, self._format_time(start), self._format_time(end)),
+        ).fetchall()
+        return self._to_dataframe(rows)
+
+    def import_legacy_data(self, data_file: str = LEGACY_DATA_FILE):
+        """Imports the measurements of the old pickle file into an empty store."""
+        if not os.path.exists(data_file):
+            return
+
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            if connection.execute("SELECT 1 FROM measurements LIMIT 1").fetchone() is None:
+                df: pd.DataFrame = pd.read_pickle(data_file)
+                connection.executemany(
+                    "INSERT OR IGNORE INTO measurements (user_id, datetime, measurement) VALUES (?, ?, ?)",
+                    [
+                        (int(user_id), self._format_time(time.to_pydatetime()), float(measurement))
+                        for time, measurement, user_id in zip(df.index, df.Measurement, df.UserID)
+                    ],
+                )
+                logger.info(f"Imported {len(df)} gas measurements from {data_file}")
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+
+
+_store: GasMeasurementsStore | None = None
+_store_lock = threading.Lock()
+
+
+def get_store() -> GasMeasurementsStore:
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = GasMeasurementsStore()
+            _store.import_legacy_data()
+            _store.rebuild_rollups()
+        return _store
@@ -0,0 +1,74 @@
+import logging
+import os
+from functools import lru_cache
+
+import pandas as pd
+from utils import HourlyPrices, TariffData, TariffsMatrix
+
+logger = logging.getLogger()
+
+# Directory with a file for each hourly price series, named after the series
+# (e.g. pvpc.csv), with the columns datetime and price (€/kWh)
+HOURLY_PRICES_DIR = os.environ.get("HOURLY_PRICES_DIR", "../data/hourly_prices")
+HOURLY_PRICES_EXTENSIONS = (".csv", ".parquet", ".pkl")
+
+
+def get_series_path(name: str) -> str:
+    for extension in HOURLY_PRICES_EXTENSIONS:
+        path = os.path.join(HOURLY_PRICES_DIR, f"{name}{extension}")
+        if os.path.exists(path):
+            return path
+    raise FileNotFoundError(f"No hourly prices file for the series {name} in {HOURLY_PRICES_DIR}")
+
+
+def read_series(path: str) -> pd.Series:
+    extension = os.path.splitext(path)[1].lower()
+    if extension == ".csv":
+        df = pd.read_csv(path, names=["datetime", "price"], header=0, parse_dates=["datetime"])
+        return df.set_index("datetime").price
+    if extension == ".parquet":
+        df = pd.read_parquet(path)
+    else:
+        df = pd.read_pickle(path)
+    if isinstance(df, pd.DataFrame):
+        return df.iloc[:, 0]
+    return df
+
+
+@lru_cache(maxsize=16)
+def load_hourly_prices(path: str, mtime: float) -> HourlyPrices:
+    # The modification time is part of the key, so changed files are read again
+    prices = HourlyPrices.from_series(read_series(path))
+    logger.info(f"Loaded {len(prices.prices)} hourly prices from {path}")
+    return prices
+
+
+def get_hourly_prices(name: str) -> HourlyPrices:
+    path = get_series_path(name)
+    return load_hourly_prices(path, os.path.getmtime(path))
+
+
+def get_tariffs_prices(
+    tariffs: list[TariffData], tariffs_matrix: TariffsMatrix
+) -> tuple[TariffsMatrix, list[HourlyPrices]]:
+    """
+    Loads the hourly price series used by the tariffs. The tariffs whose
+    series can not be loaded are left out of the comparison.
+    Returns:
+        The matrix of the tariffs that can be priced and their price series
+    """
+
+    hourly_prices = {}
+    for name in tariffs_matrix.series_names:
+        try:
+            hourly_prices[name] = get_hourly_prices(name)
+        except Exception:
+            logger.exception(f"Unable to load the hourly prices {name}")
+
+    if len(hourly_prices) < len(tariffs_matrix.series_names):
+        tariffs_matrix = TariffsMatrix.from_tariffs([
+            tariff for tariff in tariffs
+            if tariff.price_series is None or tariff.price_series in hourly_prices
+        ])
+
+    return tariffs_matrix, [hourly_prices[name] for name in tariffs_matrix.series_names]
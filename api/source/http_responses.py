@@ -0,0 +1,108 @@
+import gzip
+import json
+import os
+import threading
+from collections import OrderedDict
+from collections.abc import Hashable
+from dataclasses import dataclass, field
+from datetime import date, datetime
+from hashlib import sha1
+
+import numpy as np
+import pandas as pd
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Stored energy data results kept encoded in memory
+ENERGY_DATA_CACHE_SIZE = int(os.environ.get("ENERGY_DATA_CACHE_SIZE", 256))
+# Smaller bodies are not worth compressing
+GZIP_MIN_SIZE = 1024  # bytes
+
+
+def _default(obj):
+    if isinstance(obj, pd.Timestamp):
+        return obj.to_pydatetime().isoformat()
+    if isinstance(obj, (datetime, date)):
+        return obj.isoformat()
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def dumps(obj) -> bytes:
+    """JSON encoding of obj, the same as FastAPI returns, that also accepts numpy and pandas values."""
+    if orjson is not None:
+        return orjson.dumps(obj, default=_default, option=orjson.OPT_SERIALIZE_NUMPY)
+    return json.dumps(obj, default=_default, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+@dataclass
+class EncodedResponse:
+    """A JSON body encoded once, with its ETag and its gzip version made on first use."""
+
+    body: bytes
+    etag: str
+    _gzip_body: bytes | None = field(default=None, repr=False)
+
+    @classmethod
+    def from_obj(cls, obj) -> "EncodedResponse":
+        body = dumps(obj)
+        return cls(body=body, etag=f'"{sha1(body).hexdigest()}"')
+
+    @property
+    def gzip_body(self) -> bytes:
+        if self._gzip_body is None:
+            self._gzip_body = gzip.compress(self.body, compresslevel=6, mtime=0)
+        return self._gzip_body
+
+    @property
+    def gzip_etag(self) -> str:
+        # Strong ETags must differ between encodings of the same resource
+        return f'{self.etag[:-1]}-gzip"'
+
+    def encode(self, accept_encoding: str | None) -> tuple[bytes, str, dict]:
+        """
+        Returns:
+            The body, its ETag and the headers of the encoding accepted by the client
+        """
+        if (accept_encoding and "gzip" in accept_encoding
+                and len(self.body) >= GZIP_MIN_SIZE):
+            return self.gzip_body, self.gzip_etag, {"Content-Encoding": "gzip"}
+        return self.body, self.etag, {}
+
+
+def etag_matches(etag: str, if_none_match: str | None) -> bool:
+    if not if_none_match:
+        return False
+    tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return "*" in tags or etag in tags
+
+
+class ResponseCache:
+    """LRU of encoded responses, by a key that changes with their contents."""
+
+    def __init__(self, size: int = ENERGY_DATA_CACHE_SIZE):
+        self.size = size
+        self._responses: OrderedDict[Hashable, EncodedResponse] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> EncodedResponse | None:
+        with self._lock:
+            response = self._responses.get(key)
+            if response is not None:
+                self._responses.move_to_end(key)
+            return response
+
+    def set(self, key: Hashable, response: EncodedResponse):
+        if self.size <= 0:
+            return
+        with self._lock:
+            self._responses[key] = response
+            self._responses.move_to_end(key)
+            while len(self._responses) > self.size:
+                self._responses.popitem(last=False)
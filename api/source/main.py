@@ -1,29 +1,79 @@
 import datetime
 import logging
+import logging.handlers
+import os
+import shutil
+import tempfile
+import threading
+import time
+from contextlib import ExitStack, asynccontextmanager, contextmanager
 
+import compute
+import gas_store
+import hourly_prices
+import http_responses
+import market_prices
+import metrics
 import mongodb_interface as dbinterface
-import pandas as pd
+import numpy as np
+import reference_data
+import repricing
+import startup
 import tariffs_data
 import utils
-from fastapi import FastAPI, Form, HTTPException, UploadFile
+from bson.errors import InvalidId
+from fastapi import FastAPI, Form, Header, HTTPException, Response, UploadFile
+from fastapi.responses import JSONResponse, PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 
 logger = logging.getLogger()
-handler = logging.handlers.RotatingFileHandler(
-    "../logs/api.log", mode="a", maxBytes=1024 * 1024 * 10, backupCount=2
-)
-formatter = logging.Formatter(
-    "%(asctime)s <%(levelname).1s> %(funcName)s:%(lineno)s: %(message)s"
-)
-logger.setLevel(logging.INFO)
-handler.setFormatter(formatter)
-logger.addHandler(handler)
 
-data_file = "../data/measurements"
+LOGS_DIR = os.environ.get("LOGS_DIR", "../logs")
+# Files accepted by a single batch upload
+UPLOAD_BATCH_MAX_FILES = int(os.environ.get("UPLOAD_BATCH_MAX_FILES", 100))
+UPLOAD_COPY_CHUNK_SIZE = 1024 * 1024  # bytes
+
+
+def setup_logging():
+    if any(isinstance(h, logging.handlers.RotatingFileHandler) for h in logger.handlers):
+        return
+    handler = logging.handlers.RotatingFileHandler(
+        os.path.join(LOGS_DIR, "api.log"), mode="a", maxBytes=1024 * 1024 * 10, backupCount=2
+    )
+    formatter = logging.Formatter(
+        "%(asctime)s <%(levelname).1s> %(funcName)s:%(lineno)s: %(message)s"
+    )
+    logger.setLevel(logging.INFO)
+    handler.setFormatter(formatter)
+    logger.addHandler(handler)
+
 
-dbinterface.initIndex()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    setup_logging()
+    # Nothing blocks the startup, MongoDB and the reference data are set up
+    # in the background
+    stop = threading.Event()
+    threading.Thread(
+        target=startup.create_indexes, args=(stop,), name="mongodb-indexes", daemon=True
+    ).start()
+    reference_data.writer.start()
+    market_prices.refresher.start()
+    dbinterface.writer.start()
+    startup.warm_up.start()
+    yield
+    stop.set()
+    startup.warm_up.stop()
+    reference_data.writer.stop()
+    market_prices.refresher.stop()
+    dbinterface.writer.stop()
 
-app = FastAPI()
+
+app = FastAPI(lifespan=lifespan)
+
+# The stored results are encoded once, and once per tariffs catalog and RD10
+# prices when re-priced
+energy_data_cache = http_responses.ResponseCache()
 
 origins = [
     "https://calc.cesarsanz.dev",
@@ -41,39 +91,364 @@ app.add_middleware(
 )
 
 
-@app.post("/file-upload")
-def create_upload_file(file: UploadFile, contracted_p1: float = Form(), contracted_p2: float = Form()):
+def validate_province(province: str) -> str:
+    try:
+        return utils.get_province(province)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
-    assert contracted_p1 and contracted_p2
 
-    rd_10_prices = utils.get_rd_10_prices()
-    rd_10_mean_price = utils.get_rd_10_mean_price(rd_10_prices)
-    response = {"rd_10_mean_price": rd_10_mean_price, "monthly_data": []}
+@contextmanager
+def compute_errors():
+    """Answers the errors of the upload jobs, counting them in the uploads metric."""
+    try:
+        yield
+    except compute.ComputeBusy:
+        metrics.UPLOADS.inc(result="busy")
+        raise HTTPException(
+            status_code=429, detail="Too many uploads in progress, try again later",
+            headers={"Retry-After": str(compute.COMPUTE_RETRY_AFTER)})
+    except compute.ComputeFailed:
+        metrics.UPLOADS.inc(result="failed")
+        raise HTTPException(
+            status_code=503, detail="The upload could not be processed, try again later",
+            headers={"Retry-After": str(compute.COMPUTE_RETRY_AFTER)})
+    except ValueError as e:
+        metrics.UPLOADS.inc(result="invalid")
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@contextmanager
+def get_compute_upload(file: UploadFile):
+    """
+    The upload as the compute jobs take it. The worker processes of the
+    compute pool get the path of a copy on disk, the upload is never read
+    whole into memory.
+    """
+    if not compute.COMPUTE_WORKERS:
+        yield file.file
+        return
+    with tempfile.NamedTemporaryFile(prefix="upload-", suffix=".csv") as upload:
+        shutil.copyfileobj(file.file, upload, UPLOAD_COPY_CHUNK_SIZE)
+        upload.flush()
+        yield upload.name
+
+
+def get_upload_response(file: UploadFile, contracted_p1: float, contracted_p2: float,
+                        province: str) -> tuple[dict, str]:
+    """
+    Returns:
+        The comparison of the upload, and whether it was "stored" or "computed"
+    """
 
-    df = utils.get_dataframe(file.file)
-    for _, month_data in df.groupby([df.Fecha.dt.year, df.Fecha.dt.month]):
-        monthly_data = utils.get_data(
-            month_data, contracted_p1, contracted_p2, rd_10_mean_price, tariffs_data.tariffs)
-        response["monthly_data"].append(monthly_data)
+    with metrics.stage("rd10_lookup"):
+        rd_10_prices = market_prices.refresher.current()
+    rd_10_mean_price = rd_10_prices.mean_price
+    catalog = tariffs_data.registry.current()
+    tariffs_matrix, tariffs_hourly_prices = hourly_prices.get_tariffs_prices(
+        catalog.tariffs, catalog.matrix)
 
-    all_periods_data = utils.get_data(
-        df, contracted_p1, contracted_p2, rd_10_mean_price, tariffs_data.tariffs)
-    response["all"] = all_periods_data
+    # Return the stored result when the same file was uploaded with the same parameters
+    with metrics.stage("stored_lookup"):
+        upload_key = utils.get_upload_key(
+            file.file, contracted_p1, contracted_p2, province, catalog.version, rd_10_prices.version,
+            tariffs_matrix.series_names, [prices.version for prices in tariffs_hourly_prices])
+        db_id = dbinterface.getUploadResult(upload_key)
+        result = dbinterface.getEnergyData(db_id) if db_id else None
+    if result:
+        return result, "stored"
+
+    # The contracted powers and the versions are stored to re-price the result later
+    response = {
+        "rd_10_mean_price": rd_10_mean_price,
+        "contracted_p1": contracted_p1,
+        "contracted_p2": contracted_p2,
+        "tariffs_version": catalog.version,
+        "rd_10_version": rd_10_prices.version,
+        "monthly_data": [],
+    }
+
+    # The CPU bound pipeline runs in the compute pool when it is enabled
+    with compute_errors(), get_compute_upload(file) as upload:
+        periods_data, pipeline_timings = compute.run(
+            metrics.collect_timings, utils.get_upload_data, upload, file.size, province,
+            contracted_p1, contracted_p2, rd_10_mean_price, tariffs_matrix, tariffs_hourly_prices)
+    metrics.update(pipeline_timings)
+
+    response["monthly_data"] = periods_data[:-1]
+    response["all"] = periods_data[-1]
 
     response["createdAt"] = datetime.datetime.utcnow()
-    db_id = dbinterface.insertEnergyData(response)
+    with metrics.stage("mongo_insert"):
+        db_id = dbinterface.insertEnergyData(response)
+        dbinterface.insertUploadResult(upload_key, db_id, response["createdAt"])
     response["id"] = db_id
 
-    return {"response": response}
+    return response, "computed"
+
+
+@app.post("/file-upload")
+def create_upload_file(response: Response, file: UploadFile, contracted_p1: float = Form(),
+                       contracted_p2: float = Form(), province: str = Form(utils.DEFAULT_PROVINCE)):
+
+    assert contracted_p1 and contracted_p2
+
+    province = validate_province(province)
+
+    timings = metrics.StageTimings()
+    start = time.perf_counter()
+    try:
+        with metrics.record(timings):
+            result, upload_result = get_upload_response(
+                file, contracted_p1, contracted_p2, province)
+    finally:
+        metrics.observe_timings(timings)
+        metrics.UPLOAD_SECONDS.observe(time.perf_counter() - start)
+        metrics.UPLOAD_BYTES.observe(file.size or 0)
+        if "rows" in timings.counts:
+            metrics.UPLOAD_ROWS.observe(timings.counts["rows"])
+
+    metrics.UPLOADS.inc(result=upload_result)
+    response.headers["Server-Timing"] = timings.server_timing()
+    return {"response": result}
+
+
+def get_batch_response(files: list[UploadFile], contracted_p1: list[float],
+                       contracted_p2: list[float], province: str) -> tuple[list[dict], list[str]]:
+    """
+    Same as get_upload_response for several households. The files are parsed
+    in parallel, priced together and stored with a single batch insert.
+    Returns:
+        The comparison of every upload, and whether each one was "stored"
+        or "computed"
+    """
+
+    with metrics.stage("rd10_lookup"):
+        rd_10_prices = market_prices.refresher.current()
+    rd_10_mean_price = rd_10_prices.mean_price
+    catalog = tariffs_data.registry.current()
+    tariffs_matrix, tariffs_hourly_prices = hourly_prices.get_tariffs_prices(
+        catalog.tariffs, catalog.matrix)
+
+    # Return the stored results of the files uploaded with the same parameters
+    with metrics.stage("stored_lookup"):
+        upload_keys = [
+            utils.get_upload_key(
+                file.file, p1, p2, province, catalog.version, rd_10_prices.version,
+                tariffs_matrix.series_names, [prices.version for prices in tariffs_hourly_prices])
+            for file, p1, p2 in zip(files, contracted_p1, contracted_p2)
+        ]
+        stored_ids = dbinterface.getUploadResults(upload_keys)
+        results = [dbinterface.getEnergyData(stored_ids[upload_key]) if upload_key in stored_ids else None
+                   for upload_key in upload_keys]
+    pending = [i for i, result in enumerate(results) if not result]
+    upload_results = ["computed" if i in pending else "stored" for i in range(len(files))]
+    if not pending:
+        return results, upload_results
+
+    with compute_errors(), ExitStack() as stack:
+        uploads = [stack.enter_context(get_compute_upload(files[i])) for i in pending]
+        parsed = compute.run_many(metrics.collect_timings, [
+            (utils.get_upload_consumption, upload, files[i].size, province, tariffs_hourly_prices)
+            for i, upload in zip(pending, uploads)
+        ])
+    for _, parse_timings in parsed:
+        metrics.update(parse_timings)
+        if "rows" in parse_timings.counts:
+            metrics.UPLOAD_ROWS.observe(parse_timings.counts["rows"])
+
+    # One pricing pass for all the households
+    households_data = utils.get_households_data(
+        [months_consumption for months_consumption, _ in parsed],
+        [contracted_p1[i] for i in pending], [contracted_p2[i] for i in pending],
+        rd_10_mean_price, tariffs_matrix)
+
+    createdAt = datetime.datetime.utcnow()
+    responses = []
+    for i, periods_data in zip(pending, households_data):
+        responses.append({
+            "rd_10_mean_price": rd_10_mean_price,
+            "contracted_p1": contracted_p1[i],
+            "contracted_p2": contracted_p2[i],
+            "tariffs_version": catalog.version,
+            "rd_10_version": rd_10_prices.version,
+            "monthly_data": periods_data[:-1],
+            "all": periods_data[-1],
+            "createdAt": createdAt,
+        })
+
+    with metrics.stage("mongo_insert"):
+        db_ids = dbinterface.insertEnergyDataBatch(responses)
+        dbinterface.insertUploadResults([upload_keys[i] for i in pending], db_ids, createdAt)
+    for i, response, db_id in zip(pending, responses, db_ids):
+        response["id"] = db_id
+        results[i] = response
+
+    return results, upload_results
+
+
+@app.post("/file-upload-batch")
+def create_upload_batch(response: Response, files: list[UploadFile],
+                        contracted_p1: list[float] = Form(), contracted_p2: list[float] = Form(),
+                        province: str = Form(utils.DEFAULT_PROVINCE)):
+
+    if len(files) > UPLOAD_BATCH_MAX_FILES:
+        raise HTTPException(
+            status_code=400, detail=f"At most {UPLOAD_BATCH_MAX_FILES} files can be uploaded at once")
+    if not len(files) == len(contracted_p1) == len(contracted_p2):
+        raise HTTPException(
+            status_code=400, detail="Every file needs its contracted_p1 and contracted_p2")
+    if not all(contracted_p1) or not all(contracted_p2):
+        raise HTTPException(status_code=400, detail="The contracted powers can not be zero")
+
+    province = validate_province(province)
+
+    timings = metrics.StageTimings()
+    start = time.perf_counter()
+    try:
+        with metrics.record(timings):
+            results, upload_results = get_batch_response(
+                files, contracted_p1, contracted_p2, province)
+    finally:
+        metrics.observe_timings(timings)
+        metrics.UPLOAD_SECONDS.observe(time.perf_counter() - start)
+        for file in files:
+            metrics.UPLOAD_BYTES.observe(file.size or 0)
+
+    for upload_result in upload_results:
+        metrics.UPLOADS.inc(result=upload_result)
+    response.headers["Server-Timing"] = timings.server_timing()
+
+    names = [file.filename for file in files]
+    return {
+        "households": [{"file": name, "response": result} for name, result in zip(names, results)],
+        "summary": utils.get_households_summary(names, results),
+    }
+
+
+def get_what_if_consumption(file: UploadFile | None, db_id: str | None, province: str,
+                            catalog: tariffs_data.TariffsCatalog):
+    """
+    Returns:
+        The consumption of the whole period of a stored result or an upload,
+        the tariffs to compare and the costs of the hourly price series
+    """
+
+    if db_id:
+        # The hourly consumption is not stored, only the period tariffs are compared
+        try:
+            result = dbinterface.getEnergyData(db_id)
+        except InvalidId:
+            result = None
+        if not result:
+            raise HTTPException(status_code=400, detail=f"Unknown result: {db_id}")
+        consumption = utils.DataConsumption(**result["all"]["consumption_data"])
+        return consumption, repricing.get_repricing_tariffs(catalog.tariffs), None
+
+    if file is None:
+        raise HTTPException(status_code=400, detail="A file or a result id is required")
+
+    tariffs_matrix, tariffs_hourly_prices = hourly_prices.get_tariffs_prices(
+        catalog.tariffs, catalog.matrix)
+    with compute_errors(), get_compute_upload(file) as upload:
+        months_consumption = compute.run(
+            utils.get_upload_consumption, upload, file.size, province, tariffs_hourly_prices)
+
+    total_consumption = utils.get_total_consumption(months_consumption).iloc[0]
+    hourly_costs = total_consumption[
+        utils.get_hourly_cost_columns(len(tariffs_hourly_prices))].to_numpy(dtype=np.float64)
+    return utils.get_data_consumption(total_consumption), tariffs_matrix, hourly_costs
+
+
+@app.post("/what-if")
+def what_if(file: UploadFile | None = None, db_id: str | None = Form(None),
+            province: str = Form(utils.DEFAULT_PROVINCE),
+            contracted_p1_min: float = Form(), contracted_p1_max: float | None = Form(None),
+            contracted_p1_steps: int = Form(1),
+            contracted_p2_min: float = Form(), contracted_p2_max: float | None = Form(None),
+            contracted_p2_steps: int = Form(1),
+            rd_10_price_min: float | None = Form(None), rd_10_price_max: float | None = Form(None),
+            rd_10_price_steps: int = Form(1)):
+
+    province = validate_province(province)
+    catalog = tariffs_data.registry.current()
+    # Defaults to the current RD10 price
+    if rd_10_price_min is None:
+        rd_10_price_min = market_prices.refresher.current().mean_price
+
+    try:
+        # Before allocating the grid or parsing the upload
+        utils.check_grid_size(contracted_p1_steps, contracted_p2_steps, rd_10_price_steps)
+        contracted_p1 = utils.get_grid_axis(
+            "contracted_p1", contracted_p1_min, contracted_p1_max, contracted_p1_steps)
+        contracted_p2 = utils.get_grid_axis(
+            "contracted_p2", contracted_p2_min, contracted_p2_max, contracted_p2_steps)
+        rd_10_prices = utils.get_grid_axis(
+            "rd_10_price", rd_10_price_min, rd_10_price_max, rd_10_price_steps)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    consumption, tariffs, hourly_costs = get_what_if_consumption(file, db_id, province, catalog)
+    try:
+        result = utils.get_what_if_data(
+            consumption, contracted_p1, contracted_p2, rd_10_prices, tariffs, hourly_costs)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    # The grids are big, skip the FastAPI encoder
+    return Response(content=http_responses.dumps(result), media_type="application/json")
 
 @app.get("/energy-data/{db_id}")
-def energy_data(db_id: str):
-    result = dbinterface.getEnergyData(db_id)
-    return result
+def energy_data(db_id: str, reprice: bool = False, if_none_match: str | None = Header(None),
+                accept_encoding: str | None = Header(None)):
+    if reprice:
+        catalog = tariffs_data.registry.current()
+        rd_10_prices = market_prices.refresher.current()
+        versions = {"tariffs_version": catalog.version, "rd_10_version": rd_10_prices.version}
+        cache_key = (db_id, catalog.version, rd_10_prices.version)
+    else:
+        cache_key = db_id
+
+    encoded = energy_data_cache.get(cache_key)
+    if encoded is None:
+        document = dbinterface.getEnergyDocument(db_id)
+        if not document:
+            return {}
+        if reprice:
+            # Priced against the current tariffs and RD10 price, unless the
+            # bulk re-pricing already did it
+            if not repricing.can_reprice(document):
+                raise HTTPException(
+                    status_code=400, detail="The result was stored without its contracted powers")
+            if repricing.is_repriced(document, versions):
+                repriced = document["repriced"]
+            else:
+                [repriced] = repricing.reprice_documents(
+                    [document], rd_10_prices.mean_price,
+                    repricing.get_repricing_tariffs(catalog.tariffs), versions)
+            document = repricing.get_repriced_document(document, repriced)
+        encoded = http_responses.EncodedResponse.from_obj(dbinterface.toEnergyData(document))
+        energy_data_cache.set(cache_key, encoded)
+
+    body, etag, headers = encoded.encode(accept_encoding)
+    # The uploaded results never change, the re-priced ones change with the
+    # catalog and the RD10 prices
+    cache_headers = {
+        "ETag": etag,
+        "Vary": "Accept-Encoding",
+        "Cache-Control": ("public, no-cache" if reprice
+                          else f"public, max-age={dbinterface.ENERGY_DATA_RETENTION}, immutable"),
+    }
+    if http_responses.etag_matches(etag, if_none_match):
+        return Response(status_code=304, headers=cache_headers)
+    return Response(content=body, media_type="application/json", headers={**cache_headers, **headers})
 
 @app.get("/tariffs")
-def get_tariffs():
-    return tariffs_data.tariffs
+def get_tariffs(if_none_match: str | None = Header(None)):
+    catalog = tariffs_data.registry.current()
+    headers = {"ETag": catalog.etag, "Cache-Control": "no-cache"}
+    if http_responses.etag_matches(catalog.etag, if_none_match):
+        return Response(status_code=304, headers=headers)
+    return Response(content=catalog.json, media_type="application/json", headers=headers)
 
 
 @app.post("/gas-measurement-upload")
@@ -81,66 +456,60 @@ def add_measurement(userID: int = Form(1), consumption: float = Form()):
 
     now = datetime.datetime.now()
 
-    new_data = {"Datetime": now, "Measurement": consumption, "UserID": userID}
-    new_df = pd.DataFrame(new_data, index=[now])
-    new_df.set_index('Datetime', inplace=True)
+    store = gas_store.get_store()
     try:
-        df: pd.DataFrame = pd.read_pickle(data_file)
-        prevValue = df.iloc[-1]["Measurement"]
-        if prevValue > consumption:
-            raise HTTPException(
-                status_code=400, detail=f"Measurement is lower than previous value: {prevValue} m3")
-        df = pd.concat([df, new_df])
-
-    except FileNotFoundError:
-        df = new_df
-        return {}
-    finally:
-        df.to_pickle(data_file)
-
-    
-
-    # since last measurement
-    cost_since_last = utils.calculate_gas_cost(utils.GasDataConsumption(measurement=df.iloc[-2]["Measurement"], time=df.index[-2]),
-                                               utils.GasDataConsumption(measurement=df.iloc[-1]["Measurement"], time=df.index[-1]))
-
-    # todays consumption
-    todayDayStart = now.replace(hour=0, minute=0, second=0, microsecond=0)
-    todayDayEnd = now.replace(hour=23, minute=59, second=59, microsecond=999)
-    todays_measurements = df.loc[todayDayStart:todayDayEnd]
-    cost_today = utils.calculate_gas_cost(utils.GasDataConsumption(measurement=todays_measurements.iloc[0]["Measurement"], time=todays_measurements.index[0]),
-                                          utils.GasDataConsumption(measurement=todays_measurements.iloc[-1]["Measurement"], time=todays_measurements.index[-1]))
-
-    # this week consumptions
-    week_start = now.replace(hour=0, minute=0, second=0,
-                             microsecond=0) - datetime.timedelta(days=7)
-    week_end = now.replace(hour=23, minute=59, second=59, microsecond=999)
-    week_measurements = df.loc[week_start:week_end]
-    cost_this_week = utils.calculate_gas_cost(utils.GasDataConsumption(measurement=week_measurements.iloc[0]["Measurement"], time=week_measurements.index[0]),
-                                              utils.GasDataConsumption(measurement=week_measurements.iloc[-1]["Measurement"], time=week_measurements.index[-1]))
-
-    # this months consumptions
-    month_start = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-    month_end = now.replace(day=28, hour=23, minute=59,
-                            second=59, microsecond=999) + timedelta(days=4)
-    month_end = month_end - timedelta(days=month_end.day)
-    monthly_measurements = df.loc[month_start:month_end]
-    cost_this_month = utils.calculate_gas_cost(utils.GasDataConsumption(measurement=monthly_measurements.iloc[0]["Measurement"], time=monthly_measurements.index[0]),
-                                               utils.GasDataConsumption(measurement=monthly_measurements.iloc[-1]["Measurement"], time=monthly_measurements.index[-1]))
-
-    # last month consumptions
-    last_month_start = now.replace(
-        day=1, hour=0, minute=0, second=0, microsecond=0) - datetime.timedelta(days=30)
-    last_month_end = now.replace(
-        hour=23, minute=59, second=59, microsecond=999)
-    last_monthly_measurements = df.loc[last_month_start:last_month_end]
-    cost_last_30days = utils.calculate_gas_cost(utils.GasDataConsumption(measurement=last_monthly_measurements.iloc[0]["Measurement"], time=last_monthly_measurements.index[0]),
-                                                utils.GasDataConsumption(measurement=last_monthly_measurements.iloc[-1]["Measurement"], time=last_monthly_measurements.index[-1]))
-
-    return {"cost_since_last": cost_since_last,
-            "last_measurement": df.index[-2],
-            "cost_today": cost_today,
-            "cost_this_week": cost_this_week,
-            "cost_this_month": cost_this_month,
-            "cost_last_30days": cost_last_30days,
-            }
+        store.append(userID, now, consumption)
+    except gas_store.MeasurementError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    return utils.get_gas_costs(store, userID, now)
+
+
+@app.get("/gas-costs")
+def get_gas_costs(userID: int = 1):
+    return utils.get_gas_costs(gas_store.get_store(), userID, datetime.datetime.now())
+
+
+@app.post("/gas-measurements-import")
+def import_measurements(file: UploadFile, userID: int = Form(1)):
+    try:
+        measurements = utils.read_gas_measurements(file.file)
+        imported = gas_store.get_store().append_many(userID, measurements)
+    except gas_store.MeasurementError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid measurements file: {e}")
+
+    return {"imported": imported}
+
+
+@app.get("/gas-cost-series")
+def get_gas_cost_series(userID: int = 1, start: datetime.datetime = datetime.datetime.min,
+                        end: datetime.datetime = datetime.datetime.max):
+    measurements = gas_store.get_store().get_measurements(userID, start, end)
+    return utils.get_gas_cost_series(measurements)
+
+
+@app.get("/gas-tariffs")
+def get_gas_tariffs():
+    return tariffs_data.gas_tariffs
+
+
+@app.get("/gas-tariffs-comparison")
+def get_gas_tariffs_comparison(userID: int = 1, start: datetime.datetime = datetime.datetime.min,
+                               end: datetime.datetime = datetime.datetime.max):
+    measurements = gas_store.get_store().get_measurements(userID, start, end)
+    return utils.get_gas_tariffs_comparison(measurements, tariffs_data.gas_tariffs_matrix)
+
+
+@app.get("/metrics")
+def get_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/ready")
+def get_ready():
+    if not startup.warm_up.ready.is_set():
+        return JSONResponse(
+            status_code=503, content={"ready": False, "error": startup.warm_up.error})
+    return {"ready": True}
@@ -0,0 +1,163 @@
+import logging
+import os
+import threading
+from dataclasses import dataclass
+from datetime import datetime
+from hashlib import sha1
+from typing import Protocol
+
+import pandas as pd
+import snapshots
+import utils
+
+logger = logging.getLogger()
+
+# Local file with the RD10 prices, used instead of MIBGAS when it is set
+RD10_PRICES_FILE = os.environ.get("RD10_PRICES_FILE")
+RD10_REFRESH_INTERVAL = int(os.environ.get("RD10_REFRESH_INTERVAL", 3600))  # s
+RD10_RETRY_INTERVAL = 60  # s
+
+
+@dataclass(frozen=True)
+class RD10Prices:
+    prices: pd.DataFrame  # €/MWh, indexed by date
+    mean_price: float  # €/kWh
+    version: str
+    updated_at: datetime
+
+
+class PricesSource(Protocol):
+    def fetch(self) -> pd.DataFrame:
+        ...
+
+
+class MibgasSource:
+    """RD10 prices published by MIBGAS, cached by utils.get_rd_10_prices."""
+
+    def fetch(self) -> pd.DataFrame:
+        return utils.get_rd_10_prices()
+
+
+class FileSource:
+    """RD10 prices from a local file, for tests and offline environments."""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def fetch(self) -> pd.DataFrame:
+        extension = os.path.splitext(self.path)[1].lower()
+        if extension in (".xlsx", ".xls"):
+            return pd.read_excel(
+                self.path, sheet_name=utils.RD10_SHEET_NAME, names=["date", "price"], index_col=0
+            )
+        if extension == ".csv":
+            return pd.read_csv(
+                self.path, names=["date", "price"], header=0, index_col=0, parse_dates=True
+            )
+        return pd.read_pickle(self.path)
+
+
+class SnapshotSource:
+    """
+    RD10 prices of the shared snapshot, so all the processes use the same
+    ones. Until the first snapshot is written they come from fallback.
+    """
+
+    def __init__(self, fallback: PricesSource):
+        self.fallback = fallback
+
+    def fetch(self) -> pd.DataFrame:
+        snapshot = snapshots.reader.current()
+        if snapshot is None or "rd_10/prices" not in snapshot.arrays:
+            return self.fallback.fetch()
+        return pd.DataFrame(
+            {"price": snapshot.arrays["rd_10/prices"]},
+            index=pd.DatetimeIndex(snapshot.arrays["rd_10/dates"], name="date"),
+            copy=False,
+        )
+
+
+def get_source() -> PricesSource:
+    if RD10_PRICES_FILE:
+        return FileSource(RD10_PRICES_FILE)
+    return MibgasSource()
+
+
+class PricesRefresher:
+    """
+    Keeps the RD10 prices up to date in a background thread. Each refresh
+    publishes a new immutable RD10Prices, so the requests only read the last
+    precomputed value.
+    """
+
+    def __init__(self, source: PricesSource, interval: float = RD10_REFRESH_INTERVAL):
+        self.source = source
+        self.interval = interval
+
+        self._prices: RD10Prices | None = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def refresh(self) -> RD10Prices:
+        rd_10_prices = self.source.fetch()
+        version = sha1(
+            pd.util.hash_pandas_object(rd_10_prices).to_numpy().tobytes()
+        ).hexdigest()
+        prices = RD10Prices(
+            prices=rd_10_prices,
+            mean_price=utils.get_rd_10_mean_price(rd_10_prices),
+            version=version,
+            updated_at=datetime.utcnow(),
+        )
+
+        if self._prices is None or self._prices.version != version:
+            logger.info(f"RD10 prices updated, mean price: {prices.mean_price:.5f} €/kWh")
+        self._prices = prices
+        return prices
+
+    def current(self) -> RD10Prices:
+        """
+        Last published prices. Only the first call, if it is done before the
+        background thread has published anything, waits for a refresh.
+        """
+        prices = self._prices
+        if prices is not None:
+            return prices
+
+        with self._lock:
+            if self._prices is None:
+                self.refresh()
+            return self._prices
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="rd10-prices-refresher", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                with self._lock:
+                    self.refresh()
+                interval = self.interval
+            except Exception:
+                logger.exception("Unable to refresh the RD10 prices")
+                interval = RD10_RETRY_INTERVAL
+            self._stop.wait(interval)
+
+
+if snapshots.SNAPSHOT_FILE:
+    refresher = PricesRefresher(
+        SnapshotSource(get_source()), interval=snapshots.SNAPSHOT_CHECK_INTERVAL)
+else:
+    refresher = PricesRefresher(get_source())
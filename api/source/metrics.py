@@ -0,0 +1,230 @@
+"""
+Metrics of the API in the Prometheus text format, and the stage timings of
+the uploads.
+
+The pipeline functions time their stages with `stage`, which records into
+the StageTimings of the current call when there is one. `collect_timings`
+runs a function with a fresh StageTimings and returns it with the result, so
+the timings of the jobs run in the compute pool get back to the API process.
+"""
+
+import math
+import threading
+import time
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Callable, TypeVar
+
+T = TypeVar("T")
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+BYTES_BUCKETS = (1e4, 1e5, 5e5, 1e6, 5e6, 1e7, 2e7, 5e7, 1e8)
+ROWS_BUCKETS = (1e2, 1e3, 1e4, 5e4, 1e5, 5e5, 1e6, 5e6)
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(str(value))}"' for key, value in labels.items()) + "}"
+
+
+class Metric(ABC):
+    type = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def _key(self, labels: dict) -> tuple:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects the labels {self.labelnames}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    @abstractmethod
+    def _samples(self) -> list[str]:
+        """Lines of the samples of the metric."""
+
+    def render(self) -> str:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.type}",
+        ]
+        lines.extend(self._samples())
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: dict[tuple, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def get(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def _samples(self) -> list[str]:
+        with self._lock:
+            values = list(self._values.items())
+        return [
+            f"{self.name}{_format_labels(dict(zip(self.labelnames, key)))} {_format_value(value)}"
+            for key, value in values
+        ]
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = LATENCY_BUCKETS,
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        # Per label values: observations of each bucket, their sum and count
+        self._values: dict[tuple, tuple[list[int], float, int]] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total, count = self._values.get(key) or ([0] * len(self.buckets), 0.0, 0)
+            counts[bisect_left(self.buckets, value)] += 1
+            self._values[key] = (counts, total + value, count + 1)
+
+    def _samples(self) -> list[str]:
+        with self._lock:
+            values = [(key, list(counts), total, count)
+                      for key, (counts, total, count) in self._values.items()]
+
+        samples = []
+        for key, counts, total, count in values:
+            labels = dict(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                bucket_labels = _format_labels({**labels, "le": _format_value(bound)})
+                samples.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            samples.append(f"{self.name}_sum{_format_labels(labels)} {_format_value(total)}")
+            samples.append(f"{self.name}_count{_format_labels(labels)} {count}")
+        return samples
+
+
+REGISTRY: list[Metric] = []
+
+
+def render() -> str:
+    """All the metrics in the Prometheus text exposition format."""
+    return "\n".join(metric.render() for metric in REGISTRY) + "\n"
+
+
+UPLOAD_STAGE_SECONDS = Histogram(
+    "upload_stage_seconds", "Duration of each stage of the uploads processing", ("stage",))
+UPLOAD_SECONDS = Histogram(
+    "upload_seconds", "Duration of the uploads processing")
+UPLOAD_BYTES = Histogram(
+    "upload_bytes", "Size of the uploaded files", buckets=BYTES_BUCKETS)
+UPLOAD_ROWS = Histogram(
+    "upload_rows", "Rows of the uploaded files", buckets=ROWS_BUCKETS)
+UPLOADS = Counter(
+    "uploads_total", "Processed uploads by result", ("result",))
+CACHE_REQUESTS = Counter(
+    "cache_requests_total", "Cache lookups by cache and result", ("cache", "result"))
+
+
+@dataclass
+class StageTimings:
+    """Seconds spent in each stage of a call, and the counts it reports."""
+
+    stages: dict[str, float] = field(default_factory=dict)
+    counts: dict[str, int] = field(default_factory=dict)
+
+    def add(self, name: str, seconds: float):
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def count(self, name: str, amount: int):
+        self.counts[name] = self.counts.get(name, 0) + amount
+
+    def update(self, other: "StageTimings"):
+        for name, seconds in other.stages.items():
+            self.add(name, seconds)
+        for name, amount in other.counts.items():
+            self.count(name, amount)
+
+    def server_timing(self) -> str:
+        """Value of the Server-Timing header, durations in ms."""
+        return ", ".join(
+            f"{name};dur={seconds * 1000:.1f}" for name, seconds in self.stages.items())
+
+
+_timings: ContextVar[StageTimings | None] = ContextVar("stage_timings", default=None)
+
+
+@contextmanager
+def stage(name: str):
+    timings = _timings.get()
+    if timings is None:
+        yield
+        return
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.add(name, time.perf_counter() - start)
+
+
+def count(name: str, amount: int):
+    timings = _timings.get()
+    if timings is not None:
+        timings.count(name, amount)
+
+
+@contextmanager
+def record(timings: StageTimings):
+    """Records the stages run inside the block into timings."""
+    token = _timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _timings.reset(token)
+
+
+def update(timings: StageTimings):
+    """Adds timings, collected elsewhere, to the ones of the current call."""
+    current = _timings.get()
+    if current is not None:
+        current.update(timings)
+
+
+def collect_timings(func: Callable[..., T], *args) -> tuple[T, StageTimings]:
+    with record(StageTimings()) as timings:
+        return func(*args), timings
+
+
+def observe_timings(timings: StageTimings):
+    for name, seconds in timings.stages.items():
+        UPLOAD_STAGE_SECONDS.observe(seconds, stage=name)
@@ -1,25 +1,295 @@
-from pymongo import MongoClient
+import logging
+import os
+import queue
+import threading
+import time
+import uuid
+
+import bson
+from pymongo import MongoClient, UpdateOne
+from pymongo.errors import BulkWriteError, PyMongoError
 from bson.objectid import ObjectId
+from energy_data_format import decode_energy_data, encode_energy_data
+
+logger = logging.getLogger()
+
+MONGODB_HOST = os.environ.get("MONGODB_HOST", "mongodb")
+MONGODB_POOL_SIZE = int(os.environ.get("MONGODB_POOL_SIZE", 20))
+# Store the documents in the background, handing out their ids right away
+WRITE_BEHIND = os.environ.get("MONGODB_WRITE_BEHIND", "1") == "1"
+WRITE_BATCH_SIZE = 20
+WRITE_INTERVAL = 0.5  # s
+# Documents that could not be stored are kept here until MongoDB is back
+PENDING_FILE = os.environ.get("MONGODB_PENDING_FILE", "../data/pending_documents.bson")
+PENDING_RETRY_INTERVAL = 30  # s
+
+ENERGY_DATA_COLLECTION = "energy_data"
+# Content address of the uploads -> id of their result in energy_data
+UPLOAD_COLLECTION = "upload_index"
+
+ENERGY_DATA_RETENTION = 3600*24*30*2  # 2 months retention
+
+DUPLICATE_KEY_ERROR = 11000
+
+_db = None
+_db_lock = threading.Lock()
+
+
+def getDatabase():
+    """Database of the API, the client is created on first use."""
+    global _db
+    with _db_lock:
+        if _db is None:
+            client = MongoClient(
+                MONGODB_HOST,
+                maxPoolSize=MONGODB_POOL_SIZE,
+                minPoolSize=min(2, MONGODB_POOL_SIZE),
+                serverSelectionTimeoutMS=5000,
+            )
+            _db = client["data"]
+        return _db
+
+
+class WriteBehindWriter:
+    """
+    Inserts the documents from a background thread in small insert_many
+    batches. Until they are stored the documents can still be read from
+    memory, and if MongoDB is unavailable they are appended to a BSON file that
+    is written again later.
+    """
+
+    def __init__(self, batch_size=WRITE_BATCH_SIZE, interval=WRITE_INTERVAL, pending_file=PENDING_FILE):
+        self.batch_size = batch_size
+        self.interval = interval
+        self.pending_file = pending_file
+
+        self._queue: queue.Queue[tuple[str, dict]] = queue.Queue()
+        self._pending: dict[tuple[str, object], dict] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def put(self, collection_name: str, document: dict):
+        with self._lock:
+            self._pending[(collection_name, document["_id"])] = document
+        self._queue.put((collection_name, document))
+        self.start()
+
+    def get(self, collection_name: str, _id) -> dict | None:
+        with self._lock:
+            return self._pending.get((collection_name, _id))
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(
+                target=self._run, name="mongodb-writer", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """Stops the writer thread, storing the queued documents first."""
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is None:
+            return
+        self._stop.set()
+        thread.join(timeout=30)
+
+    def _run(self):
+        next_pending_retry = time.monotonic()
+        while not (self._stop.is_set() and self._queue.empty()):
+            try:
+                self._write_batch()
+                if time.monotonic() >= next_pending_retry:
+                    next_pending_retry = time.monotonic() + PENDING_RETRY_INTERVAL
+                    self._write_pending_file()
+            except Exception:
+                logger.exception("Unexpected error storing the documents")
+
+    def _write_batch(self):
+        try:
+            batch = [self._queue.get(timeout=self.interval)]
+        except queue.Empty:
+            return
+
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+
+        documents: dict[str, list[dict]] = {}
+        for collection_name, document in batch:
+            documents.setdefault(collection_name, []).append(document)
+        for collection_name, collection_documents in documents.items():
+            self._write(collection_name, collection_documents)
+
+    def _write(self, collection_name: str, documents: list[dict]):
+        try:
+            insertDocuments(collection_name, documents)
+        except PyMongoError:
+            logger.exception(
+                f"Unable to store {len(documents)} documents in {collection_name}, saving them to {self.pending_file}")
+            try:
+                self._save_pending(collection_name, documents)
+            except OSError:
+                logger.exception(f"Unable to save the documents to {self.pending_file}")
+                return
+        with self._lock:
+            for document in documents:
+                self._pending.pop((collection_name, document["_id"]), None)
+
+    def _save_pending(self, collection_name: str, documents: list[dict]):
+        records = b"".join(
+            bson.encode({"collection": collection_name, "document": document})
+            for document in documents
+        )
+        with open(self.pending_file, "ab") as f:
+            f.write(records)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _write_pending_file(self):
+        if not os.path.exists(self.pending_file):
+            return
+
+        # Take the file so no other writer replays the same documents
+        replay_file = f"{self.pending_file}.{uuid.uuid4().hex}"
+        try:
+            os.rename(self.pending_file, replay_file)
+        except FileNotFoundError:
+            return
+
+        with open(replay_file, "rb") as f:
+            records = list(bson.decode_file_iter(f))
+        logger.info(f"Storing {len(records)} documents saved while MongoDB was unavailable")
 
-client = MongoClient("mongodb")
-db = client["data"]
+        documents: dict[str, list[dict]] = {}
+        for record in records:
+            documents.setdefault(record["collection"], []).append(record["document"])
+        for collection_name, collection_documents in documents.items():
+            for i in range(0, len(collection_documents), self.batch_size):
+                self._write(collection_name, collection_documents[i:i + self.batch_size])
 
-collection = db['energy_data']
+        os.remove(replay_file)
+
+
+writer = WriteBehindWriter()
 
 
 def initIndex():
-    collection.create_index("createdAt", expireAfterSeconds=3600*24*30*2) # 2 months retention
+    db = getDatabase()
+    db[ENERGY_DATA_COLLECTION].create_index("createdAt", expireAfterSeconds=ENERGY_DATA_RETENTION)
+    db[UPLOAD_COLLECTION].create_index("createdAt", expireAfterSeconds=ENERGY_DATA_RETENTION)
+
+
+def insertDocuments(collection_name, documents):
+    try:
+        getDatabase()[collection_name].insert_many(documents, ordered=False)
+    except BulkWriteError as e:
+        # The documents already stored are fine, they are written more than once on retries
+        errors = [error for error in e.details["writeErrors"]
+                  if error["code"] != DUPLICATE_KEY_ERROR]
+        if errors or e.details.get("writeConcernErrors"):
+            raise
+
+
+def insertDocument(collection_name, document):
+    if WRITE_BEHIND:
+        writer.put(collection_name, document)
+    else:
+        insertDocuments(collection_name, [document])
+
+
+def insertDocumentsBatch(collection_name, documents):
+    # The writer groups them in insert_many batches too
+    if WRITE_BEHIND:
+        for document in documents:
+            writer.put(collection_name, document)
+    else:
+        insertDocuments(collection_name, documents)
 
 
 def insertEnergyData(energy_data) -> str:
-    result = collection.insert_one(energy_data)
-    del energy_data["_id"]
-    return str(result.inserted_id)
+    document = dict(encode_energy_data(energy_data), _id=ObjectId())
+    insertDocument(ENERGY_DATA_COLLECTION, document)
+    return str(document["_id"])
+
+
+def insertEnergyDataBatch(energy_data_list) -> list[str]:
+    documents = [dict(encode_energy_data(energy_data), _id=ObjectId())
+                 for energy_data in energy_data_list]
+    if documents:
+        insertDocumentsBatch(ENERGY_DATA_COLLECTION, documents)
+    return [str(document["_id"]) for document in documents]
+
+def getEnergyDocument(db_id):
+    """Stored document of a result, in the compact format."""
+    _id = ObjectId(db_id)
+    return (writer.get(ENERGY_DATA_COLLECTION, _id)
+            or getDatabase()[ENERGY_DATA_COLLECTION].find_one({"_id": _id}))
+
+
+def toEnergyData(document):
+    result = decode_energy_data(document)
+    result["id"] = str(result.pop("_id"))
+    return result
+
 
 def getEnergyData(db_id):
-    result = collection.find_one({"_id": ObjectId(db_id)})
-    if not result:
+    document = getEnergyDocument(db_id)
+    if not document:
         return {}
-    del result["_id"]
-    result["id"] = db_id
-    return result
\ No newline at end of file
+    return toEnergyData(document)
+
+
+def findEnergyDocuments(query, projection=None, batch_size=1000):
+    return getDatabase()[ENERGY_DATA_COLLECTION].find(query, projection, batch_size=batch_size)
+
+
+def updateRepricedResults(document_ids, repriced):
+    # The uploaded results are kept as they were stored
+    getDatabase()[ENERGY_DATA_COLLECTION].bulk_write(
+        [UpdateOne({"_id": _id}, {"$set": {"repriced": document_repriced}})
+         for _id, document_repriced in zip(document_ids, repriced)],
+        ordered=False,
+    )
+
+
+def insertUploadResult(upload_key, db_id, createdAt):
+    # Expires together with the result it points to
+    insertDocument(UPLOAD_COLLECTION, {
+        "_id": upload_key, "energy_data_id": db_id, "createdAt": createdAt})
+
+
+def insertUploadResults(upload_keys, db_ids, createdAt):
+    documents = [{"_id": upload_key, "energy_data_id": db_id, "createdAt": createdAt}
+                 for upload_key, db_id in zip(upload_keys, db_ids)]
+    if documents:
+        insertDocumentsBatch(UPLOAD_COLLECTION, documents)
+
+
+def getUploadResults(upload_keys) -> dict[str, str]:
+    """Ids of the results of the uploads already stored, by their upload key."""
+    results = {}
+    missing = []
+    for upload_key in upload_keys:
+        result = writer.get(UPLOAD_COLLECTION, upload_key)
+        if result:
+            results[upload_key] = result["energy_data_id"]
+        else:
+            missing.append(upload_key)
+    if missing:
+        try:
+            for result in getDatabase()[UPLOAD_COLLECTION].find({"_id": {"$in": missing}}):
+                results[result["_id"]] = result["energy_data_id"]
+        except PyMongoError:
+            # Computed again, and stored by the writer when MongoDB is back
+            logger.exception("Unable to look up the stored upload results")
+    return results
+
+
+def getUploadResult(upload_key) -> str | None:
+    return getUploadResults([upload_key]).get(upload_key)
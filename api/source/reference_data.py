@@ -0,0 +1,111 @@
+import fcntl
+import logging
+import os
+import threading
+from datetime import date
+
+import market_prices
+import numpy as np
+import snapshots
+import tariffs_data
+import utils
+
+logger = logging.getLogger()
+
+# Provinces and years whose holidays are included in the snapshot
+SNAPSHOT_PROVINCES = os.environ.get(
+    "REFERENCE_SNAPSHOT_PROVINCES", utils.DEFAULT_PROVINCE).split(",")
+SNAPSHOT_YEARS = 3  # This year and the previous ones
+SNAPSHOT_WRITE_INTERVAL = 60  # s
+
+
+def get_snapshot_data() -> tuple[dict, dict]:
+    """
+    Returns:
+        The arrays and the metadata of a snapshot with the tariffs, the RD10
+        prices and the holidays
+    """
+    arrays, metadata = tariffs_data.registry.origin().to_snapshot()
+
+    rd_10_prices = market_prices.get_source().fetch()
+    arrays["rd_10/dates"] = rd_10_prices.index.to_numpy().astype("datetime64[ns]")
+    arrays["rd_10/prices"] = rd_10_prices.price.to_numpy(dtype=np.float64)
+
+    this_year = date.today().year
+    for province in SNAPSHOT_PROVINCES:
+        province = province.strip().lower()
+        for year in range(this_year - SNAPSHOT_YEARS + 1, this_year + 1):
+            arrays[snapshots.get_holidays_name(province, year)] = snapshots.encode_holidays(
+                np.array(utils.get_province_holidays(province, year), dtype="datetime64[D]"),
+                year,
+            )
+
+    return arrays, metadata
+
+
+class SnapshotWriter:
+    """
+    Writes the reference data snapshot from a background thread, whenever
+    its contents change. Every process runs one, but only the process that
+    holds the lock of the snapshot writes it.
+    """
+
+    def __init__(self, path: str | None = snapshots.SNAPSHOT_FILE, interval: float = SNAPSHOT_WRITE_INTERVAL):
+        self.path = path
+        self.interval = interval
+
+        self._lock_file = None
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def start(self):
+        if not self.path or self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="snapshot-writer", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
+
+    def _acquire(self) -> bool:
+        if self._lock_file is not None:
+            return True
+        lock_file = open(f"{self.path}.lock", "a")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock_file.close()
+            return False
+        logger.info(f"Writing the reference data snapshot {self.path} from this process")
+        self._lock_file = lock_file
+        return True
+
+    def write(self):
+        arrays, metadata = get_snapshot_data()
+        version = snapshots.get_snapshot_version(arrays, metadata)
+
+        current = snapshots.Snapshot(self.path) if os.path.exists(self.path) else None
+        if current is not None and current.version == version:
+            return
+        snapshots.write_snapshot(self.path, arrays, metadata)
+        logger.info(f"Reference data snapshot {version[:12]} written")
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                if self._acquire():
+                    self.write()
+            except Exception:
+                logger.exception(f"Unable to write the reference data snapshot {self.path}")
+            self._stop.wait(self.interval)
+
+
+writer = SnapshotWriter()
@@ -0,0 +1,161 @@
+"""
+Re-prices stored results against the current tariffs catalog and RD10 price,
+from the monthly aggregates and contracted powers kept in the documents, so
+the files do not need to be uploaded again.
+
+The uploaded results are never modified, the re-priced costs are stored next
+to them in the "repriced" field of the documents.
+
+The tariffs with hourly prices can not be re-priced, pricing them needs the
+hourly consumption, which is not stored. They are left out of re-priced
+results, their costs are only in the uploaded results.
+
+Run as a script to re-price all the stored results:
+    python repricing.py
+"""
+
+import datetime
+import logging
+import time
+
+import market_prices
+import mongodb_interface as dbinterface
+import numpy as np
+import tariffs_data
+from energy_data_format import FORMAT_VERSION, encode_costs
+from utils import DataConsumption, TariffData, TariffsMatrix, get_rd_10_thresholds, get_tariffs_costs
+
+logger = logging.getLogger()
+
+REPRICE_BATCH_SIZE = 1000
+
+
+def get_repricing_tariffs(tariffs: list[TariffData]) -> TariffsMatrix:
+    return TariffsMatrix.from_tariffs(
+        [tariff for tariff in tariffs if tariff.price_series is None])
+
+
+def can_reprice(document: dict) -> bool:
+    # Only the documents stored with their contracted powers
+    return document.get("format") == FORMAT_VERSION and "contracted_p1" in document
+
+
+def is_repriced(document: dict, versions: dict) -> bool:
+    repriced = document.get("repriced")
+    return bool(repriced) and all(repriced.get(key) == value for key, value in versions.items())
+
+
+def get_repriced_document(document: dict, repriced: dict) -> dict:
+    """
+    Returns:
+        A copy of the document with the re-priced costs instead of the
+        uploaded ones
+    """
+    return {
+        **{key: value for key, value in document.items() if key != "repriced"},
+        **{key: value for key, value in repriced.items()
+           if key not in ("tariff_names", "th_rd_10_threshold", "tariff_costs")},
+        "tariff_names": repriced["tariff_names"],
+        "periods": {
+            **document["periods"],
+            "th_rd_10_threshold": repriced["th_rd_10_threshold"],
+            "tariff_costs": repriced["tariff_costs"],
+        },
+    }
+
+
+def reprice_documents(
+    documents: list[dict],
+    rd_10_mean_price: float,
+    tariffs: TariffsMatrix,
+    versions: dict,
+) -> list[dict]:
+    """
+    Prices the periods of all the documents in a single pass.
+    Returns:
+        The re-priced costs of every document, with the versions they were
+        priced with
+    """
+
+    consumptions = []
+    contracted_p1 = []
+    contracted_p2 = []
+    offsets = [0]
+    for document in documents:
+        periods = document["periods"]
+        consumptions.extend(
+            DataConsumption(
+                consumption_p1=consumption_p1,
+                consumption_p2=consumption_p2,
+                consumption_p3=consumption_p3,
+                num_days=num_days,
+            )
+            for consumption_p1, consumption_p2, consumption_p3, num_days in zip(
+                periods["consumption_p1"], periods["consumption_p2"],
+                periods["consumption_p3"], periods["num_days"])
+        )
+        num_periods = len(periods["num_days"])
+        contracted_p1.extend([document["contracted_p1"]] * num_periods)
+        contracted_p2.extend([document["contracted_p2"]] * num_periods)
+        offsets.append(offsets[-1] + num_periods)
+
+    costs = get_tariffs_costs(
+        np.array(contracted_p1), np.array(contracted_p2), consumptions, rd_10_mean_price, tariffs)
+    thresholds = get_rd_10_thresholds(costs, consumptions, tariffs)
+
+    return [
+        {
+            **versions,
+            "rd_10_mean_price": rd_10_mean_price,
+            "tariff_names": tariffs.names,
+            "th_rd_10_threshold": thresholds[start:end],
+            "tariff_costs": encode_costs(costs.total_cost[start:end]),
+        }
+        for start, end in zip(offsets[:-1], offsets[1:])
+    ]
+
+
+def reprice_stored_results(batch_size: int = REPRICE_BATCH_SIZE) -> int:
+    """
+    Re-prices the stored results that were not re-priced yet with the current
+    catalog and RD10 prices, storing the new costs in bulk.
+    Returns:
+        The number of re-priced results
+    """
+    catalog = tariffs_data.registry.current()
+    rd_10_prices = market_prices.refresher.current()
+    tariffs = get_repricing_tariffs(catalog.tariffs)
+    versions = {"tariffs_version": catalog.version, "rd_10_version": rd_10_prices.version}
+
+    cursor = dbinterface.findEnergyDocuments({
+        "format": FORMAT_VERSION,
+        "contracted_p1": {"$exists": True},
+        "$or": [{f"repriced.{key}": {"$ne": value}} for key, value in versions.items()],
+    }, projection={"periods.tariff_costs": False, "repriced": False}, batch_size=batch_size)
+
+    start = time.perf_counter()
+    repriced = 0
+    batch = []
+    for document in cursor:
+        batch.append(document)
+        if len(batch) < batch_size:
+            continue
+        dbinterface.updateRepricedResults(
+            [document["_id"] for document in batch],
+            reprice_documents(batch, rd_10_prices.mean_price, tariffs, versions))
+        repriced += len(batch)
+        batch = []
+    if batch:
+        dbinterface.updateRepricedResults(
+            [document["_id"] for document in batch],
+            reprice_documents(batch, rd_10_prices.mean_price, tariffs, versions))
+        repriced += len(batch)
+
+    elapsed = time.perf_counter() - start
+    logger.info(f"Re-priced {repriced} results in {elapsed:.2f} s")
+    return repriced
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    print(f"{datetime.datetime.now()}: re-priced {reprice_stored_results()} results")
@@ -0,0 +1,193 @@
+"""
+Binary snapshots of the reference data shared by all the API processes.
+
+A snapshot file is a JSON header followed by raw arrays:
+
+    magic (8 bytes) | header size (uint64 little endian) | header (JSON) | arrays
+
+The header holds the version, free form metadata and the dtype, shape and
+offset of every array. The arrays start at 64 byte aligned offsets, so the
+readers memory-map the file and use the arrays as read-only numpy views
+without copying them. Snapshots are written to a temporary file and moved
+into place, so the readers always map a complete file.
+"""
+
+import json
+import logging
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+from hashlib import sha1
+
+import numpy as np
+
+logger = logging.getLogger()
+
+# Snapshot shared by the processes, the reference data is loaded by each
+# process when it is not set
+SNAPSHOT_FILE = os.environ.get("REFERENCE_SNAPSHOT_FILE")
+SNAPSHOT_CHECK_INTERVAL = 5  # s
+
+MAGIC = b"ECSNAP01"
+ALIGNMENT = 64
+
+
+def get_snapshot_version(arrays: dict[str, np.ndarray], metadata: dict) -> str:
+    """Hash of the contents of a snapshot."""
+    version = sha1(json.dumps(metadata, sort_keys=True, default=str).encode("utf-8"))
+    for name, array in sorted(arrays.items()):
+        array = np.ascontiguousarray(array)
+        version.update(f"{name}{array.dtype.str}{array.shape}".encode("utf-8"))
+        version.update(array.tobytes())
+    return version.hexdigest()
+
+
+def write_snapshot(path: str, arrays: dict[str, np.ndarray], metadata: dict) -> str:
+    """
+    Returns:
+        The version of the snapshot
+    """
+    arrays = {name: np.ascontiguousarray(array) for name, array in arrays.items()}
+    version = get_snapshot_version(arrays, metadata)
+
+    # Offsets relative to the start of the arrays section
+    layout = {}
+    offset = 0
+    for name, array in arrays.items():
+        offset += -offset % ALIGNMENT
+        layout[name] = {"dtype": array.dtype.str, "shape": list(array.shape), "offset": offset}
+        offset += array.nbytes
+
+    header = json.dumps(
+        {"version": version, "metadata": metadata, "arrays": layout}, default=str
+    ).encode("utf-8")
+    header += b" " * (-(len(MAGIC) + 8 + len(header)) % ALIGNMENT)
+    data_start = len(MAGIC) + 8 + len(header)
+
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-snapshot-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(MAGIC)
+            f.write(struct.pack("<Q", len(header)))
+            f.write(header)
+            for name, array in arrays.items():
+                f.seek(data_start + layout[name]["offset"])
+                f.write(array.tobytes())
+            # Empty arrays at the end still need their offset inside the file
+            f.truncate(data_start + offset)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    return version
+
+
+class Snapshot:
+    """A memory-mapped snapshot, its arrays are read-only views of the file."""
+
+    def __init__(self, path: str):
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if self._mmap[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"{path} is not a reference data snapshot")
+        (header_size,) = struct.unpack_from("<Q", self._mmap, len(MAGIC))
+        header_start = len(MAGIC) + 8
+        header = json.loads(self._mmap[header_start:header_start + header_size])
+        data_start = header_start + header_size
+
+        self.path = path
+        self.version: str = header["version"]
+        self.metadata: dict = header["metadata"]
+        self.arrays: dict[str, np.ndarray] = {}
+        for name, layout in header["arrays"].items():
+            dtype = np.dtype(layout["dtype"])
+            shape = tuple(layout["shape"])
+            self.arrays[name] = np.frombuffer(
+                self._mmap, dtype=dtype, count=int(np.prod(shape)),
+                offset=data_start + layout["offset"],
+            ).reshape(shape)
+
+    def get(self, name: str) -> np.ndarray | None:
+        return self.arrays.get(name)
+
+    def get_holidays(self, province: str, year: int) -> np.ndarray | None:
+        """Holidays of a province and year, as a sorted datetime64[D] array."""
+        bitmap = self.arrays.get(get_holidays_name(province, year))
+        if bitmap is None:
+            return None
+        return decode_holidays(bitmap, year)
+
+
+def get_holidays_name(province: str, year: int) -> str:
+    return f"holidays/{province}/{year}"
+
+
+def encode_holidays(holidays: np.ndarray, year: int) -> np.ndarray:
+    """Bitmap of the days of the year that are holidays, one bit per day."""
+    first_day = np.datetime64(f"{year}-01-01", "D")
+    days = np.zeros(366, dtype=bool)
+    positions = (np.asarray(holidays, dtype="datetime64[D]") - first_day).astype(np.int64)
+    days[positions[(positions >= 0) & (positions < 366)]] = True
+    return np.packbits(days)
+
+
+def decode_holidays(bitmap: np.ndarray, year: int) -> np.ndarray:
+    first_day = np.datetime64(f"{year}-01-01", "D")
+    return first_day + np.flatnonzero(np.unpackbits(bitmap)).astype("timedelta64[D]")
+
+
+class SnapshotReader:
+    """
+    Keeps the snapshot file mapped, checking at most every check_interval
+    seconds whether a new one was written.
+    """
+
+    def __init__(self, path: str | None = SNAPSHOT_FILE, check_interval: float = SNAPSHOT_CHECK_INTERVAL):
+        self.path = path
+        self.check_interval = check_interval
+
+        self._snapshot: Snapshot | None = None
+        self._stat: tuple | None = None
+        self._next_check = 0.0
+        self._lock = threading.Lock()
+
+    def current(self) -> Snapshot | None:
+        if not self.path:
+            return None
+        if time.monotonic() >= self._next_check:
+            self._check()
+        return self._snapshot
+
+    def _check(self):
+        with self._lock:
+            if time.monotonic() < self._next_check:
+                return
+            self._next_check = time.monotonic() + self.check_interval
+            try:
+                stat = os.stat(self.path)
+            except FileNotFoundError:
+                return
+            # A new snapshot is a new file, with another inode
+            key = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+            if key == self._stat:
+                return
+            try:
+                snapshot = Snapshot(self.path)
+            except Exception:
+                logger.exception(f"Unable to read the snapshot {self.path}")
+                return
+            if self._snapshot is None or snapshot.version != self._snapshot.version:
+                logger.info(f"Reference data snapshot {snapshot.version[:12]} loaded")
+            # The previous mapping is released when nothing uses its arrays
+            self._snapshot = snapshot
+            self._stat = key
+
+
+reader = SnapshotReader()
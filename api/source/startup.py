@@ -0,0 +1,105 @@
+import logging
+import threading
+import time
+from datetime import date, timedelta
+
+import compute
+import hourly_prices
+import market_prices
+import mongodb_interface as dbinterface
+import tariffs_data
+import utils
+
+logger = logging.getLogger()
+
+WARM_UP_RETRY_INTERVAL = 30  # s
+INDEX_RETRY_INTERVAL = 60  # s
+
+
+def get_sample_upload(days: int = 31) -> bytes:
+    """Small distributor csv with the hourly consumption of the last days."""
+    first_day = date.today() - timedelta(days=days)
+    lines = ["CUPS;Fecha;Hora;Consumo_kWh;Metodo_obtencion"]
+    for i in range(days):
+        day = (first_day + timedelta(days=i)).strftime("%d/%m/%Y")
+        lines.extend(f"ES0000000000000000XX0F;{day};{hour};0,250;R" for hour in range(1, 25))
+    return ("\n".join(lines) + "\n").encode("utf-8")
+
+
+class WarmUp:
+    """
+    Loads everything the uploads need in a background thread: the tariffs,
+    the hourly prices, the holidays and the RD10 prices, and then prices a
+    sample upload, so the first real upload does not pay for any of it. It
+    is retried until it succeeds, and the API reports itself ready after it.
+    """
+
+    def __init__(self, retry_interval: float = WARM_UP_RETRY_INTERVAL):
+        self.retry_interval = retry_interval
+
+        self.ready = threading.Event()
+        self.error: str | None = None
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="warm-up", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def warm_up(self):
+        start = time.perf_counter()
+
+        catalog = tariffs_data.registry.current()
+        tariffs_matrix, tariffs_hourly_prices = hourly_prices.get_tariffs_prices(
+            catalog.tariffs, catalog.matrix)
+
+        # The uploads usually cover this year and the previous one
+        this_year = date.today().year
+        for year in (this_year - 1, this_year):
+            utils.get_holidays_calendar(utils.DEFAULT_PROVINCE, year)
+
+        rd_10_prices = market_prices.refresher.current()
+
+        # Runs the whole pipeline once, in a worker of the compute pool when it
+        # is enabled so the workers are started too
+        sample = get_sample_upload()
+        compute.run(
+            utils.get_upload_data, sample, len(sample), utils.DEFAULT_PROVINCE, 3.3, 3.3,
+            rd_10_prices.mean_price, tariffs_matrix, tariffs_hourly_prices)
+
+        logger.info(f"Warm up finished in {time.perf_counter() - start:.2f} s")
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.warm_up()
+                self.error = None
+                self.ready.set()
+                return
+            except Exception as e:
+                logger.exception("Unable to warm up, retrying")
+                self.error = str(e)
+            self._stop.wait(self.retry_interval)
+
+
+def create_indexes(stop: threading.Event):
+    """Creates the MongoDB indexes, retrying until MongoDB is available."""
+    while not stop.is_set():
+        try:
+            dbinterface.initIndex()
+            return
+        except Exception:
+            logger.exception("Unable to create the MongoDB indexes, retrying")
+        stop.wait(INDEX_RETRY_INTERVAL)
+
+
+warm_up = WarmUp()
@@ -1,4 +1,23 @@
-from utils import TariffData
+import json
+import logging
+import os
+import threading
+import time
+from dataclasses import asdict, dataclass
+from hashlib import sha1
+
+import snapshots
+from utils import GasTariffData, GasTariffsMatrix, TariffData, TariffsMatrix, TUR_GAS_TARIFF
+
+logger = logging.getLogger()
+
+# JSON file with the tariffs catalog, used instead of the tariffs below when
+# it is set. It is loaded again whenever it changes.
+TARIFFS_FILE = os.environ.get("TARIFFS_FILE")
+TARIFFS_CHECK_INTERVAL = 30  # s
+# JSON file with the gas tariffs catalog, used instead of the gas tariffs
+# below when it is set. It is loaded on startup.
+GAS_TARIFFS_FILE = os.environ.get("GAS_TARIFFS_FILE")
 
 tariffs = [
     TariffData(
@@ -145,13 +164,213 @@ tariffs = [
         power_cost_p2=0.014670,
         rd_10_included=False,
     ),
+    # Priced hour by hour with the prices of pvpc.csv in HOURLY_PRICES_DIR
     # TariffData(
     #     name="PVPC",
-    #     energy_cost_p1=0.3015,
-    #     energy_cost_p2=0.2291,
-    #     energy_cost_p3=0.1930,
+    #     energy_cost_p1=0.0,
+    #     energy_cost_p2=0.0,
+    #     energy_cost_p3=0.0,
     #     power_cost_p1=0.071682,
     #     power_cost_p2=0.003448,
     #     rd_10_included=True,
+    #     price_series="pvpc",
     # ),
 ]
+
+
+@dataclass(frozen=True)
+class TariffsCatalog:
+    """
+    A loaded tariffs catalog with everything derived from it: the index by
+    name, the columnar copy used to price all the tariffs at once, the
+    version and the serialized /tariffs response.
+    """
+
+    tariffs: list[TariffData]
+    index: dict[str, int]
+    matrix: TariffsMatrix
+    version: str  # Changes whenever the catalog changes
+    json: bytes
+    etag: str
+
+    @classmethod
+    def from_tariffs(
+        cls, tariffs: list[TariffData], matrix: TariffsMatrix | None = None
+    ) -> "TariffsCatalog":
+        version = sha1(repr(tariffs).encode("utf-8")).hexdigest()
+        return cls(
+            tariffs=tariffs,
+            index={tariff.name: i for i, tariff in enumerate(tariffs)},
+            matrix=matrix or TariffsMatrix.from_tariffs(tariffs),
+            version=version,
+            json=json.dumps(
+                [asdict(tariff) for tariff in tariffs],
+                ensure_ascii=False, separators=(",", ":"),
+            ).encode("utf-8"),
+            etag=f'"{version}"',
+        )
+
+    @classmethod
+    def from_snapshot(cls, snapshot: snapshots.Snapshot) -> "TariffsCatalog":
+        """Catalog whose price columns are views of the shared snapshot."""
+        tariffs = [TariffData(**tariff) for tariff in snapshot.metadata["tariffs"]]
+        matrix = TariffsMatrix(
+            names=[tariff.name for tariff in tariffs],
+            energy_costs=snapshot.arrays["tariffs/energy_costs"],
+            power_costs=snapshot.arrays["tariffs/power_costs"],
+            rd_10_included=snapshot.arrays["tariffs/rd_10_included"],
+            series_names=snapshot.metadata["tariffs_series_names"],
+            series_index=snapshot.arrays["tariffs/series_index"],
+        )
+        return cls.from_tariffs(tariffs, matrix)
+
+    def to_snapshot(self) -> tuple[dict, dict]:
+        """
+        Returns:
+            The arrays and the metadata of the catalog for a snapshot
+        """
+        arrays = {
+            "tariffs/energy_costs": self.matrix.energy_costs,
+            "tariffs/power_costs": self.matrix.power_costs,
+            "tariffs/rd_10_included": self.matrix.rd_10_included,
+            "tariffs/series_index": self.matrix.series_index,
+        }
+        metadata = {
+            "tariffs": [asdict(tariff) for tariff in self.tariffs],
+            "tariffs_series_names": self.matrix.series_names,
+        }
+        return arrays, metadata
+
+    def get(self, name: str) -> TariffData | None:
+        i = self.index.get(name)
+        return None if i is None else self.tariffs[i]
+
+
+def load_tariffs(path: str) -> list[TariffData]:
+    with open(path, encoding="utf-8") as f:
+        return [TariffData(**tariff) for tariff in json.load(f)]
+
+
+class TariffRegistry:
+    """
+    Holds the current TariffsCatalog. When the catalog comes from a file it
+    is checked for changes at most every check_interval seconds, and a new
+    catalog replaces the previous one as a whole, so the requests never see
+    a half updated catalog. When there is a shared snapshot, its catalog is
+    used instead, so all the processes use the same one.
+    """
+
+    def __init__(
+        self,
+        default_tariffs: list[TariffData],
+        path: str | None = TARIFFS_FILE,
+        check_interval: float = TARIFFS_CHECK_INTERVAL,
+    ):
+        self.default_tariffs = default_tariffs
+        self.path = path
+        self.check_interval = check_interval
+
+        self._lock = threading.Lock()
+        self._mtime: float | None = None
+        self._next_check = time.monotonic() + check_interval
+        self._catalog = self._load()
+        self._snapshot_catalog: tuple[str, TariffsCatalog] | None = None
+
+    def _load(self) -> TariffsCatalog:
+        if not self.path:
+            return TariffsCatalog.from_tariffs(self.default_tariffs)
+        self._mtime = os.path.getmtime(self.path)
+        return TariffsCatalog.from_tariffs(load_tariffs(self.path))
+
+    def reload(self) -> TariffsCatalog:
+        with self._lock:
+            catalog = self._load()
+            if catalog.version != self._catalog.version:
+                logger.info(f"Tariffs catalog updated, {len(catalog.tariffs)} tariffs")
+            self._catalog = catalog
+            return catalog
+
+    def current(self) -> TariffsCatalog:
+        snapshot = snapshots.reader.current()
+        if snapshot is not None and "tariffs" in snapshot.metadata:
+            return self._get_snapshot_catalog(snapshot)
+        return self.origin()
+
+    def origin(self) -> TariffsCatalog:
+        """Catalog of the tariffs file, or of the default tariffs."""
+        if self.path and time.monotonic() >= self._next_check:
+            self._check_file()
+        return self._catalog
+
+    def _get_snapshot_catalog(self, snapshot: snapshots.Snapshot) -> TariffsCatalog:
+        cached = self._snapshot_catalog
+        if cached is None or cached[0] != snapshot.version:
+            cached = (snapshot.version, TariffsCatalog.from_snapshot(snapshot))
+            self._snapshot_catalog = cached
+        return cached[1]
+
+    def _check_file(self):
+        with self._lock:
+            if time.monotonic() < self._next_check:
+                return
+            self._next_check = time.monotonic() + self.check_interval
+            try:
+                changed = os.path.getmtime(self.path) != self._mtime
+            except OSError:
+                logger.exception(f"Unable to check the tariffs file {self.path}")
+                return
+        if changed:
+            try:
+                self.reload()
+            except Exception:
+                # Keep the current catalog until the file is fixed
+                logger.exception(f"Unable to reload the tariffs file {self.path}")
+
+
+registry = TariffRegistry(tariffs)
+
+def load_gas_tariffs(path: str) -> list[GasTariffData]:
+    with open(path, encoding="utf-8") as f:
+        return [GasTariffData(**tariff) for tariff in json.load(f)]
+
+
+# Prices without taxes. The TUR tariffs are the regulated ones of each annual
+# consumption band: TUR 1 up to 5.000 kWh, TUR 2 up to 15.000 kWh and TUR 3
+# up to 50.000 kWh.
+default_gas_tariffs = [
+    TUR_GAS_TARIFF,
+    GasTariffData(
+        name="TUR 2",
+        fixed_cost_per_day=0.329370,
+        energy_cost=0.057578,
+    ),
+    GasTariffData(
+        name="TUR 3",
+        fixed_cost_per_day=0.670849,
+        energy_cost=0.051316,
+    ),
+    GasTariffData(
+        name="Naturgy Tarifa Por Uso Gas",
+        fixed_cost_per_day=0.259068,
+        energy_cost=0.089918,
+    ),
+    GasTariffData(
+        name="Endesa One Gas",
+        fixed_cost_per_day=0.263014,
+        energy_cost=0.072050,
+    ),
+    GasTariffData(
+        name="Iberdrola Plan Online Gas",
+        fixed_cost_per_day=0.287014,
+        energy_cost=0.079000,
+    ),
+    GasTariffData(
+        name="TotalEnergies A Tu Aire Gas",
+        fixed_cost_per_day=0.206137,
+        energy_cost=0.069900,
+    ),
+]
+
+gas_tariffs = load_gas_tariffs(GAS_TARIFFS_FILE) if GAS_TARIFFS_FILE else default_gas_tariffs
+
+gas_tariffs_matrix = GasTariffsMatrix.from_tariffs(gas_tariffs)
@@ -1,56 +1,133 @@
 import logging
 import logging.config
 import math
-import os
-import pickle
 from dataclasses import dataclass
-from datetime import datetime, timedelta
-from hashlib import sha1
+import calendar
+from datetime import date, datetime, timedelta
+from functools import lru_cache
+from hashlib import sha1, sha256
 from typing import BinaryIO
 
+import metrics
+import numpy as np
 import pandas as pd
+import snapshots
+from caching import DAY, cached
 from holidays_es import Province
 
+try:
+    import pyarrow  # noqa: F401
+    CSV_ENGINE = "pyarrow"
+except ImportError:
+    CSV_ENGINE = "c"
+
 logger = logging.getLogger()
 
+ENERGY_MONITOR_COST_PER_DAY = 0.02663  # €
+SOCIAL_BONUS_COST_PER_DAY = 0.036718  # €
+ELECTRICITY_TAX = 0.5  # %
+GENERAL_TAX = 5.0  # %
+
+# Energy column of the distributors csv files. Some of them name it "AE_kWh",
+# it is renamed to ENERGY_COLUMN when the file is read.
+ENERGY_COLUMN = "Consumo_kWh"
+ENERGY_COLUMNS = ("Consumo_kWh", "AE_kWh")
+
+# Uploads bigger than this are aggregated in chunks of STREAM_CHUNK_SIZE rows
+STREAM_MIN_FILE_SIZE = 20 * 1024 * 1024  # bytes
+STREAM_CHUNK_SIZE = 500_000  # rows
+
+# Time zone of the hours of the consumption files
+LOCAL_TIMEZONE = "Europe/Madrid"
+
+# What-if grids of contracted powers and RD10 prices
+WHAT_IF_MAX_POINTS = 100_000
+WHAT_IF_CHUNK_SIZE = 1_000_000  # costs evaluated at once
+
+# Period of each hour (0-24) of a working day. P1: from 10:00 to 14:00 and from
+# 18:00 to 22:00. P2: from 08:00 to 10:00, from 14:00 to 18:00 and from 22:00
+# to 24:00. P3: from 00:00 to 08:00, the extra hour of the DST change day,
+# weekend days and holidays.
+HOUR_PERIODS = np.array(
+    [3] * 8 + [2] * 2 + [1] * 4 + [2] * 4 + [1] * 4 + [2] * 2 + [3], dtype=np.int8
+)
+
+
+RD10_PRICES_URL = (
+    "https://www.mibgas.es/es/file-access/MIBGAS_Data_2023.xlsx?path=AGNO_2023/XLS"
+)
+RD10_SHEET_NAME = "PGN_RD_10_2022"
+
 
-def disk_cache(func):
-    cache_dir = "cache"
-    if not os.path.exists(cache_dir):
-        os.makedirs(cache_dir)
-
-    def wrapper(*args, **kwargs):
-        cache_key = sha1(
-            (
-                str(func.__module__) + str(func.__name__) +
-                str(args) + str(kwargs)
-            ).encode("utf-8")
-        ).hexdigest()
-        cache_path = os.path.join(cache_dir, cache_key)
-        if os.path.exists(cache_path):
-            modification_time = datetime.fromtimestamp(
-                os.path.getmtime(cache_path))
-            if modification_time > datetime.now() - timedelta(days=1):
-                with open(cache_path, "rb") as f:
-                    return pickle.load(f)
-        result = func(*args, **kwargs)
-        with open(cache_path, "wb") as f:
-            pickle.dump(result, f)
-        return result
-
-    return wrapper
-
-
-@disk_cache
+@cached(ttl=DAY, stale_ttl=DAY)
 def get_rd_10_prices() -> pd.DataFrame:
-    rd_10_prices_url = (
-        "https://www.mibgas.es/es/file-access/MIBGAS_Data_2023.xlsx?path=AGNO_2023/XLS"
-    )
     return pd.read_excel(
-        rd_10_prices_url, sheet_name="PGN_RD_10_2022", names=["date", "price"], index_col=0
+        RD10_PRICES_URL, sheet_name=RD10_SHEET_NAME, names=["date", "price"], index_col=0
     )
 
 
+DEFAULT_PROVINCE = "madrid"
+# Names of the provinces in calendarioslaborales.com, the source of the
+# holidays, with the spellings it has used
+PROVINCES = frozenset((
+    "a-coruna", "alava", "albacete", "alicante", "almeria", "asturias", "avila", "badajoz",
+    "baleares", "barcelona", "bizkaia", "burgos", "caceres", "cadiz", "cantabria", "castellon",
+    "ceuta", "ciudad-real", "cordoba", "coruna", "cuenca", "gipuzkoa", "girona", "granada",
+    "guadalajara", "guipuzcoa", "huelva", "huesca", "islas-baleares", "jaen", "la-rioja",
+    "las-palmas", "leon", "lleida", "lugo", "madrid", "malaga", "melilla", "murcia", "navarra",
+    "ourense", "palencia", "pontevedra", "salamanca", "santa-cruz-de-tenerife", "segovia",
+    "sevilla", "soria", "tarragona", "tenerife", "teruel", "toledo", "valencia", "valladolid",
+    "vizcaya", "zamora", "zaragoza",
+))
+
+
+def get_province(province: str) -> str:
+    """
+    Normalizes the name of a province.
+    Raises:
+        ValueError: if it is not a known province
+    """
+
+    province = province.strip().lower()
+    if province not in PROVINCES:
+        raise ValueError(f"Invalid province: {province}")
+    return province
+
+
+@cached(ttl=30 * DAY, stale_ttl=365 * DAY)
+def get_province_holidays(province: str, year: int) -> list[date]:
+    province_holidays = Province(name=province, year=year)
+    return (
+        province_holidays.national_holidays()
+        + province_holidays.regional_holidays()
+    )
+
+
+@lru_cache(maxsize=None)
+def get_process_holidays_calendar(province: str, year: int) -> np.ndarray:
+    return np.unique(
+        np.array(get_province_holidays(province, year), dtype="datetime64[D]")
+    )
+
+
+def get_holidays_calendar(province: str, year: int) -> np.ndarray:
+    """
+    Calendar with the national and regional holidays of a province, as a
+    sorted array of days. It comes from the shared snapshot when it has the
+    province and year, otherwise it is loaded once per process.
+    """
+    snapshot = snapshots.reader.current()
+    if snapshot is not None:
+        holidays = snapshot.get_holidays(province, year)
+        if holidays is not None:
+            return holidays
+    try:
+        return get_process_holidays_calendar(province, year)
+    except Exception as e:
+        # holidays_es raises a bare Exception for the provinces and years it does not have
+        raise ValueError(f"Unable to get the holidays of {province} in {year}: {e}") from e
+
+
 def get_rd_10_mean_price(rd_10_prices):
     # Get the mean of the last 30 days
     return rd_10_prices.iloc[:30].price.mean() / 1000.0
@@ -93,9 +170,6 @@ class ElectricityCost:
     total_cost: float = 0.0  # €
 
     def __post_init__(self):
-        ELECTRICITY_TAX = 0.5  # %
-        GENERAL_TAX = 5.0  # %
-
         electricity_cost = self.cost_without_taxes
 
         self.electricity_cost_tax = electricity_cost * ELECTRICITY_TAX / 100.0
@@ -127,6 +201,9 @@ class TariffData:
     power_cost_p1: float  # €/kW/day
     power_cost_p2: float  # €/kW/day
     rd_10_included: bool  # The tarrif includes the RD 10 2022 into the prices
+    # Name of the hourly price series of indexed tariffs. Their energy is
+    # priced hour by hour and the energy_cost_p* prices are not used.
+    price_series: str | None = None
 
     def calculate_electricity_cost(
         self,
@@ -136,9 +213,6 @@ class TariffData:
         rd_10_mean_price: float,
     ) -> ElectricityCost:
 
-        ENERGY_MONITOR_COST_PER_DAY = 0.02663  # €
-        SOCIAL_BONUS_COST_PER_DAY = 0.036718  # €
-
         energy_monitor_cost = consumption.num_days * ENERGY_MONITOR_COST_PER_DAY
         social_bonus_cost = consumption.num_days * SOCIAL_BONUS_COST_PER_DAY
 
@@ -166,143 +240,766 @@ class TariffData:
         )
 
 
-def get_dataframe(file: BinaryIO) -> pd.DataFrame:
+
+@dataclass(frozen=True)
+class TariffsMatrix:
     """
-    Calculates the energy periods consumption.
-    Returns:
-        DataConsumption instance
+    Columnar view of a tariffs catalog, one row per tariff, so every tariff
+    can be priced at once with array operations.
+    """
+
+    names: list[str]
+    energy_costs: np.ndarray  # €/kWh, shape (tariffs, 3)
+    power_costs: np.ndarray  # €/kW/day, shape (tariffs, 2)
+    rd_10_included: np.ndarray  # bool, shape (tariffs,)
+    series_names: list[str]  # Hourly price series used by the tariffs
+    # Position in series_names of the price series of each tariff, -1 for
+    # the tariffs with period prices, shape (tariffs,)
+    series_index: np.ndarray
+
+    @classmethod
+    def from_tariffs(cls, tariffs: list[TariffData]) -> "TariffsMatrix":
+        series_names = list(dict.fromkeys(
+            t.price_series for t in tariffs if t.price_series is not None))
+        return cls(
+            names=[t.name for t in tariffs],
+            energy_costs=np.array(
+                [[t.energy_cost_p1, t.energy_cost_p2, t.energy_cost_p3]
+                 for t in tariffs],
+                dtype=np.float64,
+            ).reshape(-1, 3),
+            power_costs=np.array(
+                [[t.power_cost_p1, t.power_cost_p2] for t in tariffs],
+                dtype=np.float64,
+            ).reshape(-1, 2),
+            rd_10_included=np.array(
+                [t.rd_10_included for t in tariffs], dtype=bool),
+            series_names=series_names,
+            series_index=np.array(
+                [-1 if t.price_series is None else series_names.index(t.price_series)
+                 for t in tariffs],
+                dtype=np.intp,
+            ),
+        )
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+
+@dataclass(frozen=True)
+class CostsMatrix:
+    """
+    Electricity costs of every consumption period (rows) against every
+    tariff (columns). Mirrors the fields of ElectricityCost.
     """
 
-    # Read the file
-    df = pd.read_csv(filepath_or_buffer=file, sep=";", decimal=",")
+    energy_cost: np.ndarray  # €
+    power_cost: np.ndarray  # €
+    rd_10_cost: np.ndarray  # €
+    energy_monitor_cost: np.ndarray  # €, shape (periods, 1)
+    social_bonus_cost: np.ndarray  # €, shape (periods, 1)
+    total_cost: np.ndarray  # €
+
+    @property
+    def cost_without_taxes(self) -> np.ndarray:
+        return (
+            self.energy_cost
+            + self.power_cost
+            + self.rd_10_cost
+            + self.social_bonus_cost
+        )
 
-    # Parse the column "Fecha" as a datetime object
-    df.Fecha = pd.to_datetime(df.Fecha, format="%d/%m/%Y")
 
-    # Get the National Holidays
-    df["year"] = pd.DatetimeIndex(df.Fecha).year
-    years = df.year.unique()
-    holidays = {}
-    for year in years:
-        year_holidays = Province(name="madrid", year=year)
-        holidays[year] = year_holidays.national_holidays()
+@dataclass(frozen=True)
+class HourlyPrices:
+    """
+    Hourly price series on a regular grid: prices[i] is the price of the hour
+    start + i hours, so the prices of any hours are a single array lookup.
+    """
+
+    start: np.datetime64  # datetime64[h]
+    prices: np.ndarray  # €/kWh, float32
+    mean_price: float  # €/kWh
+    version: str
+
+    @classmethod
+    def from_series(cls, series: pd.Series) -> "HourlyPrices":
+        """
+        Aligns a price series indexed by datetime. The hours with a UTC offset
+        are converted to the local time of the consumption files. The hours
+        missing from it are priced at the mean price.
+        """
+        if series.empty:
+            raise ValueError("The hourly price series is empty")
+
+        index = series.index
+        if not isinstance(index, pd.DatetimeIndex):
+            # The offsets change with the DST, those series are read as text
+            index = pd.to_datetime(index, utc=pd.Timestamp(index[0]).tzinfo is not None)
+        if index.tz is not None:
+            index = index.tz_convert(LOCAL_TIMEZONE).tz_localize(None)
+        hours = index.to_numpy().astype("datetime64[h]")
+        start = hours.min()
+        positions = (hours - start).astype(np.int64)
+
+        prices = np.full(positions.max() + 1, np.nan, dtype=np.float32)
+        prices[positions] = series.to_numpy(dtype=np.float32)
+        mean_price = float(np.nanmean(prices))
+        prices[np.isnan(prices)] = mean_price
+
+        version = sha1(str(start).encode("utf-8") + prices.tobytes()).hexdigest()
+        return cls(start=start, prices=prices, mean_price=mean_price, version=version)
+
+    def lookup(self, hours: np.ndarray) -> np.ndarray:
+        """Prices of the hours (datetime64[h]), the mean price outside the series."""
+        positions = (hours - self.start).astype(np.int64)
+        inside = (positions >= 0) & (positions < len(self.prices))
+        return np.where(
+            inside,
+            self.prices[np.clip(positions, 0, len(self.prices) - 1)],
+            np.float32(self.mean_price),
+        )
+
+
+def get_hourly_cost_columns(num_series: int) -> list[str]:
+    return [f"hourly_cost_{i}" for i in range(num_series)]
+
+
+def get_energy_column(file: BinaryIO) -> str:
+    """
+    Detects the name of the energy column from the csv header, leaving the
+    file at its start.
+    """
+    header = file.readline()
+    file.seek(0)
+
+    columns = header.decode("utf-8-sig").strip().split(";")
+    for column in ENERGY_COLUMNS:
+        if column in columns:
+            return column
+
+    raise ValueError(f"Unknown consumption file format: {header[:200]!r}")
+
+
+def read_csv(file: BinaryIO, energy_column: str, **kwargs):
+    """
+    Reads a distributor csv file with a fixed compact schema: int8 hours and
+    float32 kWh.
+    """
+    return pd.read_csv(
+        filepath_or_buffer=file,
+        sep=";",
+        decimal=",",
+        usecols=["Fecha", "Hora", energy_column],
+        dtype={"Fecha": str, "Hora": np.int8, energy_column: np.float32},
+        **kwargs,
+    )
+
+
+def tag_dataframe(df: pd.DataFrame, energy_column: str, province: str) -> pd.DataFrame:
+    """
+    Parses the dates of a freshly read csv and tags each row with its tariff
+    period.
+    Raises:
+        ValueError: The csv has no rows
+    """
+
+    if df.empty:
+        raise ValueError("The consumption file is empty")
+
+    df.rename(columns={energy_column: ENERGY_COLUMN}, inplace=True)
+
+    # Parse the column "Fecha" as a datetime object, each day is parsed once
+    df.Fecha = pd.to_datetime(df.Fecha, format="%d/%m/%Y", cache=True)
 
     # Create a new column indicating if the day is a weekend day or not
     df["weekend"] = df.Fecha.dt.dayofweek // 5 == 1
+
     # Create a new column indicating if the day was a holiday day or not
-    df["holiday"] = df.apply(lambda row: row.Fecha.date()
-                             in holidays[row.year], axis=1)
+    holidays = np.concatenate([
+        get_holidays_calendar(province, int(year))
+        for year in df.Fecha.dt.year.unique()
+    ])
+    df["holiday"] = np.isin(df.Fecha.to_numpy().astype("datetime64[D]"), holidays)
 
     # Make the hours start from 0
     df.Hora = df.Hora - 1
 
+    # Tag each row with its tariff period code: 1 (P1), 2 (P2) or 3 (P3)
+    df["period"] = np.where(
+        df.weekend | df.holiday,
+        np.int8(3),
+        HOUR_PERIODS[df.Hora.clip(0, len(HOUR_PERIODS) - 1).to_numpy()],
+    ).astype(np.int8)
+
     return df
 
 
+def get_upload_key(file: BinaryIO, *params) -> str:
+    """
+    Content address of an upload: hash of the file bytes and of the
+    parameters its result depends on. Leaves the file at its start.
+    """
+    upload_hash = sha256()
+    for chunk in iter(lambda: file.read(1024 * 1024), b""):
+        upload_hash.update(chunk)
+    file.seek(0)
+
+    upload_hash.update(repr(params).encode("utf-8"))
+    return upload_hash.hexdigest()
+
+
+def get_dataframe(file: BinaryIO, province: str = DEFAULT_PROVINCE) -> pd.DataFrame:
+    """
+    Reads a whole distributor csv file and tags each row with its tariff
+    period.
+    Returns:
+        DataFrame with the columns Fecha, Hora (int8), Consumo_kWh (float32),
+        weekend, holiday and period (int8)
+    """
+
+    energy_column = get_energy_column(file)
+    with metrics.stage("csv_parse"):
+        df = read_csv(file, energy_column, engine=CSV_ENGINE)
+    metrics.count("rows", len(df))
+    with metrics.stage("holiday_tagging"):
+        return tag_dataframe(df, energy_column, province)
+
+
+def get_months_consumption_stream(
+    file: BinaryIO,
+    province: str = DEFAULT_PROVINCE,
+    chunksize: int = STREAM_CHUNK_SIZE,
+    hourly_prices: list[HourlyPrices] = (),
+) -> pd.DataFrame:
+    """
+    Same result as get_months_consumption(get_dataframe(file)), but the file
+    is read in chunks that are added to running monthly accumulators, so the
+    memory used is bounded by the number of months instead of rows.
+    """
+
+    energy_column = get_energy_column(file)
+
+    periods_columns = ["consumption_p1", "consumption_p2", "consumption_p3"]
+    periods_columns += get_hourly_cost_columns(len(hourly_prices))
+    consumption = None
+    first_day = None
+    last_day = None
+    days = []
+    chunks = read_csv(file, energy_column, chunksize=chunksize)
+    while True:
+        with metrics.stage("csv_parse"):
+            chunk = next(chunks, None)
+        if chunk is None:
+            break
+        metrics.count("rows", len(chunk))
+        with metrics.stage("holiday_tagging"):
+            chunk = tag_dataframe(chunk, energy_column, province)
+        with metrics.stage("period_aggregation"):
+            chunk_consumption = get_months_consumption(chunk, hourly_prices)
+
+        if consumption is None:
+            consumption = chunk_consumption[periods_columns]
+            first_day = chunk_consumption.first_day
+            last_day = chunk_consumption.last_day
+        else:
+            consumption = consumption.add(
+                chunk_consumption[periods_columns], fill_value=0.0)
+            first_day = first_day.combine_first(chunk_consumption.first_day)
+            last_day = chunk_consumption.last_day.combine_first(last_day)
+
+        # A day can be split between two chunks, keep the days to count them once
+        days.append(chunk.Fecha.unique())
+
+    if consumption is None:
+        raise ValueError("The consumption file is empty")
+
+    days = pd.Series(np.unique(np.concatenate(days)))
+    num_days = days.groupby(
+        [days.dt.year.rename("year"), days.dt.month.rename("month")]).size()
+
+    months_consumption = consumption.join(num_days.rename("num_days"))
+    months_consumption["first_day"] = first_day
+    months_consumption["last_day"] = last_day
+    return months_consumption
+
+
+def get_months_hourly_costs(
+    df: pd.DataFrame, months: list[pd.Series], hourly_prices: list[HourlyPrices]
+) -> pd.DataFrame:
+    """
+    Energy cost of every month at each hourly price series: the dot product
+    of the hourly consumption and the prices of the same hours.
+    """
+
+    # The 25th hour of the days with a time change is priced as the 24th
+    hours = (
+        df.Fecha.to_numpy().astype("datetime64[h]")
+        + np.minimum(df.Hora.to_numpy(), 23).astype("timedelta64[h]")
+    )
+    consumption = df[ENERGY_COLUMN].to_numpy(dtype=np.float64)
+
+    costs = pd.DataFrame(
+        {column: consumption * prices.lookup(hours)
+         for column, prices in zip(get_hourly_cost_columns(len(hourly_prices)), hourly_prices)},
+        index=df.index,
+    )
+    return costs.groupby(months, sort=True).sum()
+
+
+def get_months_consumption(
+    df: pd.DataFrame, hourly_prices: list[HourlyPrices] = ()
+) -> pd.DataFrame:
+    """
+    Aggregates the consumption of each period and the number of days of every
+    month with a single grouped reduction over the period code column.
+    Returns:
+        DataFrame indexed by (year, month) with the DataConsumption fields
+        plus the first and last day of each month, and the hourly_cost_*
+        columns of the hourly price series
+    """
+
+    months = [df.Fecha.dt.year.rename("year"), df.Fecha.dt.month.rename("month")]
+
+    consumption = (
+        # Add up in double precision, the energy column is stored as float32
+        df[ENERGY_COLUMN].astype(np.float64)
+        .groupby(months + [df.period], sort=True)
+        .sum()
+        .unstack("period", fill_value=0.0)
+        .reindex(columns=[1, 2, 3], fill_value=0.0)
+    )
+    consumption.columns = ["consumption_p1", "consumption_p2", "consumption_p3"]
+
+    days = df.groupby(months, sort=True).Fecha.agg(
+        num_days="nunique", first_day="first", last_day="last")
+
+    months_consumption = consumption.join(days)
+    if hourly_prices:
+        months_consumption = months_consumption.join(
+            get_months_hourly_costs(df, months, hourly_prices))
+
+    # Make sure we have divided the different consumption periods correctly,
+    # the blank consumption values are skipped like in the grouped sums
+    assert math.isclose(
+        months_consumption[
+            ["consumption_p1", "consumption_p2", "consumption_p3"]].to_numpy().sum(),
+        np.nansum(df[ENERGY_COLUMN].to_numpy(dtype=np.float64)),
+    )
+
+    return months_consumption
+
+
+def get_total_consumption(months_consumption: pd.DataFrame) -> pd.DataFrame:
+    """
+    Adds up the monthly aggregates into the consumption of the whole period,
+    without scanning the rows again.
+    """
+
+    hourly_cost_columns = [
+        column for column in months_consumption.columns if column.startswith("hourly_cost_")]
+    total = months_consumption[
+        ["consumption_p1", "consumption_p2", "consumption_p3", "num_days"]
+        + hourly_cost_columns].sum()
+    total["first_day"] = months_consumption.first_day.min()
+    total["last_day"] = months_consumption.last_day.max()
+    return total.to_frame("all").T
+
+
+def get_data_consumption(period: pd.Series) -> DataConsumption:
+    return DataConsumption(
+        consumption_p1=float(period.consumption_p1),
+        consumption_p2=float(period.consumption_p2),
+        consumption_p3=float(period.consumption_p3),
+        num_days=int(period.num_days),
+    )
+
+
 def get_periods_consumption(df: pd.DataFrame) -> DataConsumption:
+    total_consumption = get_total_consumption(get_months_consumption(df))
+    return get_data_consumption(total_consumption.iloc[0])
 
-    energyColumn = "Consumo_kWh"
-    if energyColumn not in df.columns:
-        energyColumn = "AE_kWh"
-
-    # P1 consumption: from 10:00 to 14:00 and from 18:00 to 22:00
-    consumption_p1 = df.loc[
-        ~df.weekend
-        & ~df.holiday
-        & ((df.Hora >= 10) & (df.Hora < 14) | (df.Hora >= 18) & (df.Hora < 22))
-    ][energyColumn].sum()
-
-    # P2 consumption: from 08:00 to 10:00, from 14:00 to 18:00 and from 22:00 to 24:00
-    consumption_p2 = df.loc[
-        ~df.weekend
-        & ~df.holiday
-        & (
-            (df.Hora >= 8) & (df.Hora < 10)
-            | (df.Hora >= 14) & (df.Hora < 18)
-            | (df.Hora >= 22) & (df.Hora < 24)
-        )
-    ][energyColumn].sum()
-
-    # P3 consumption: from 00:00 to 08:00, weekend days and holidays
-    consumption_p3 = df.loc[df.weekend | df.holiday | (df.Hora >= 0) & (df.Hora < 8)][
-        energyColumn
-    ].sum()
-
-    data = DataConsumption(
-        consumption_p1=consumption_p1,
-        consumption_p2=consumption_p2,
-        consumption_p3=consumption_p3,
-        num_days=len(df.groupby("Fecha")),
+
+def get_tariffs_costs(
+    contracted_p1: float | np.ndarray,
+    contracted_p2: float | np.ndarray,
+    consumptions: list[DataConsumption],
+    rd_10_mean_price: float | np.ndarray,
+    tariffs: TariffsMatrix,
+    hourly_costs: np.ndarray | None = None,
+) -> CostsMatrix:
+    """
+    Prices every consumption period against every tariff in one pass.
+    The math is the same as TariffData.calculate_electricity_cost, except for
+    the energy of the tariffs with hourly prices, taken from hourly_costs
+    (€, shape (periods, series)). The contracted powers and the RD10 price
+    are either the same for all the periods or arrays with the values of
+    each period.
+    """
+
+    periods_consumption = np.array(
+        [[c.consumption_p1, c.consumption_p2, c.consumption_p3]
+         for c in consumptions],
+        dtype=np.float64,
+    ).reshape(-1, 3)
+    num_days = np.array(
+        [c.num_days for c in consumptions], dtype=np.float64).reshape(-1, 1)
+    total_consumption = periods_consumption.sum(axis=1, keepdims=True)
+
+    energy_monitor_cost = num_days * ENERGY_MONITOR_COST_PER_DAY
+    social_bonus_cost = num_days * SOCIAL_BONUS_COST_PER_DAY
+
+    # Shape (2,), or (periods, 2) with the powers of each period
+    contracted_powers = np.stack(np.broadcast_arrays(
+        np.asarray(contracted_p1, dtype=np.float64),
+        np.asarray(contracted_p2, dtype=np.float64),
+    ), axis=-1)
+    power_cost = num_days * (contracted_powers @ tariffs.power_costs.T)
+    energy_cost = periods_consumption @ tariffs.energy_costs.T
+    hourly_tariffs = tariffs.series_index >= 0
+    if hourly_tariffs.any():
+        if hourly_costs is None:
+            raise ValueError("The hourly costs are required to price hourly tariffs")
+        energy_cost[:, hourly_tariffs] = hourly_costs[:, tariffs.series_index[hourly_tariffs]]
+    rd_10_cost = np.where(
+        tariffs.rd_10_included, 0.0,
+        total_consumption * np.reshape(np.asarray(rd_10_mean_price, dtype=np.float64), (-1, 1))
     )
 
-    # Make sure we have divided the different consumption periods correctly
-    assert math.isclose(data.total_consumption, df[energyColumn].sum())
+    electricity_cost = energy_cost + power_cost + rd_10_cost + social_bonus_cost
+    electricity_cost_tax = electricity_cost * ELECTRICITY_TAX / 100.0
+    tax_base = electricity_cost + electricity_cost_tax + energy_monitor_cost
+    tax = tax_base * GENERAL_TAX / 100.0
+
+    return CostsMatrix(
+        energy_cost=energy_cost,
+        power_cost=power_cost,
+        rd_10_cost=rd_10_cost,
+        energy_monitor_cost=energy_monitor_cost,
+        social_bonus_cost=social_bonus_cost,
+        total_cost=tax_base + tax,
+    )
 
-    return data
 
+def get_rd_10_thresholds(
+    costs: CostsMatrix,
+    consumptions: list[DataConsumption],
+    tariffs: TariffsMatrix
+) -> list[float | None]:
+    """
+    RD10 price below which the best tariff without the RD10 included beats
+    the best tariff with it, for every consumption period.
+    """
 
-def get_rd_10_threshold(
-    contracted_p1: float,
-    contracted_p2: float,
-    consumption_data: pd.DataFrame,
-    tariffs_costs: list[tuple[str, float]],
-    rd_10_mean_price: float,
-    tariffs: list[TariffData]
-) -> float | None:
+    # We need at least one tariff of each kind to compare them
+    if tariffs.rd_10_included.all() or not tariffs.rd_10_included.any():
+        return [None] * len(consumptions)
 
     # Get the best tariffs with the RD10 included and not included
-    best_rd_tariff = None
-    best_non_rd_tariff = None
-    for tariff_name, tariff_cost in tariffs_costs:
-        for t in tariffs:
-            if t.name == tariff_name:
-                if t.rd_10_included and not best_rd_tariff:
-                    best_rd_tariff = t
-                elif not t.rd_10_included and not best_non_rd_tariff:
-                    best_non_rd_tariff = t
-                break
-        if best_rd_tariff and best_non_rd_tariff:
-            break
+    best_rd_tariff = np.where(
+        tariffs.rd_10_included, costs.total_cost, np.inf).argmin(axis=1)
+    best_non_rd_tariff = np.where(
+        tariffs.rd_10_included, np.inf, costs.total_cost).argmin(axis=1)
+
+    rows = np.arange(len(consumptions))
+    total_consumption = np.array(
+        [c.total_consumption for c in consumptions], dtype=np.float64)
+
+    # Calculate the RD10 threshold
+    with np.errstate(divide="ignore", invalid="ignore"):
+        thresholds = (
+            costs.cost_without_taxes[rows, best_rd_tariff]
+            - costs.energy_cost[rows, best_non_rd_tariff]
+            - costs.power_cost[rows, best_non_rd_tariff]
+        ) / total_consumption
+
+    return thresholds.tolist()
+
+
+def get_periods_data(
+    periods_consumption: pd.DataFrame,
+    contracted_p1: float | np.ndarray,
+    contracted_p2: float | np.ndarray,
+    rd_10_mean_price: float,
+    tariffs: TariffsMatrix
+) -> list[dict]:
+    """
+    Builds the tariffs comparison of several consumption periods, as returned
+    by get_months_consumption, pricing all of them at once. The contracted
+    powers can be arrays with the powers of each period.
+    """
 
-    if best_rd_tariff and best_non_rd_tariff:
+    consumptions = [
+        get_data_consumption(period) for _, period in periods_consumption.iterrows()
+    ]
 
-        # Get the cost of the best tariffs
-        best_rd_10_tariff_cost = best_rd_tariff.calculate_electricity_cost(
-            consumption_data, contracted_p1, contracted_p2, rd_10_mean_price
-        )
-        best_non_rd_10_tariff_cost = best_non_rd_tariff.calculate_electricity_cost(
-            consumption_data, contracted_p1, contracted_p2, rd_10_mean_price
-        )
+    hourly_costs = periods_consumption[
+        get_hourly_cost_columns(len(tariffs.series_names))].to_numpy(dtype=np.float64)
 
-        # Calculate the RD10 threshold
-        return (
-            best_rd_10_tariff_cost.cost_without_taxes
-            - best_non_rd_10_tariff_cost.energy_cost
-            - best_non_rd_10_tariff_cost.power_cost
-        ) / consumption_data.total_consumption
+    costs = get_tariffs_costs(
+        contracted_p1, contracted_p2, consumptions, rd_10_mean_price, tariffs, hourly_costs
+    )
+    # Order the tarifs by energy cost
+    rankings = np.argsort(costs.total_cost, axis=1, kind="stable")
+    thresholds = get_rd_10_thresholds(costs, consumptions, tariffs)
+
+    periods_data = []
+    for consumption_data, first_day, last_day, total_costs, ranking, threshold in zip(
+        consumptions,
+        periods_consumption.first_day,
+        periods_consumption.last_day,
+        costs.total_cost.tolist(),
+        rankings.tolist(),
+        thresholds,
+    ):
+        data = {
+            "consumption_data": consumption_data.__dict__,
+            "tariffs": [],
+            "first_day": first_day,
+            "last_day": last_day,
+        }
+        bestTariffCost = total_costs[ranking[0]]
+        for tariff_index in ranking:
+            tariff_cost = total_costs[tariff_index]
+            data["tariffs"].append(
+                {"name": tariffs.names[tariff_index],
+                 "tariff_cost": tariff_cost,
+                 "tariff_cost_diff": tariff_cost - bestTariffCost})
+
+        data["th_rd_10_threshold"] = threshold
+        periods_data.append(data)
+
+    return periods_data
+
+
+def get_upload_consumption(
+    file: BinaryIO | str,
+    file_size: int | None,
+    province: str,
+    hourly_prices: list[HourlyPrices] = (),
+) -> pd.DataFrame:
+    """
+    Parse stage of the uploads. It only takes picklable arguments so it can
+    run in a worker process, which gets the path of the file instead of the
+    file object.
+    Returns:
+        The consumption of every month, as returned by get_months_consumption
+    """
 
+    if isinstance(file, str):
+        with open(file, "rb") as f:
+            return get_upload_consumption(f, file_size, province, hourly_prices)
 
-def get_tariffs_costs(
+    # Big uploads are aggregated in chunks to keep the memory bounded
+    if file_size is not None and file_size > STREAM_MIN_FILE_SIZE:
+        return get_months_consumption_stream(file, province, hourly_prices=hourly_prices)
+
+    df = get_dataframe(file, province)
+    with metrics.stage("period_aggregation"):
+        return get_months_consumption(df, hourly_prices)
+
+
+def get_upload_data(
+    file: BinaryIO | str,
+    file_size: int | None,
+    province: str,
     contracted_p1: float,
     contracted_p2: float,
-    consumption_data: pd.DataFrame,
     rd_10_mean_price: float,
-    tariffs: list[TariffData]
-) -> list[tuple[str, float]]:
-    # Get a list with the energy costs for each tariff
-    tariffs_costs = [
-        (
-            t.name,
-            t.calculate_electricity_cost(
-                consumption_data, contracted_p1, contracted_p2, rd_10_mean_price
-            ).total_cost,
+    tariffs: TariffsMatrix,
+    hourly_prices: list[HourlyPrices] = (),
+) -> list[dict]:
+    """
+    Whole parse and price pipeline of an uploaded file. Like
+    get_upload_consumption, it can run in a worker process. hourly_prices are
+    the series of tariffs.series_names, in the same order.
+    Returns:
+        The data of every month followed by the data of the whole period
+    """
+
+    months_consumption = get_upload_consumption(file, file_size, province, hourly_prices)
+    periods_consumption = pd.concat(
+        [months_consumption, get_total_consumption(months_consumption)])
+
+    # Price every month and the whole period against all the tariffs at once
+    with metrics.stage("tariff_pricing"):
+        return get_periods_data(
+            periods_consumption, contracted_p1, contracted_p2, rd_10_mean_price, tariffs
         )
-        for t in tariffs
+
+
+def get_households_data(
+    households_consumption: list[pd.DataFrame],
+    contracted_p1: list[float],
+    contracted_p2: list[float],
+    rd_10_mean_price: float,
+    tariffs: TariffsMatrix,
+) -> list[list[dict]]:
+    """
+    Prices the months and the whole period of several households, as
+    returned by get_upload_consumption, against all the tariffs at once, each
+    household with its own contracted powers.
+    Returns:
+        The data of every household, as returned by get_upload_data
+    """
+
+    households_periods = [
+        pd.concat([months_consumption, get_total_consumption(months_consumption)])
+        for months_consumption in households_consumption
     ]
-    # Order the tarifs by energy cost
-    tariffs_costs.sort(key=lambda x: x[1])
+    num_periods = [len(periods) for periods in households_periods]
+
+    with metrics.stage("tariff_pricing"):
+        periods_data = get_periods_data(
+            pd.concat(households_periods),
+            np.repeat(np.asarray(contracted_p1, dtype=np.float64), num_periods),
+            np.repeat(np.asarray(contracted_p2, dtype=np.float64), num_periods),
+            rd_10_mean_price,
+            tariffs,
+        )
 
-    return tariffs_costs
+    offsets = np.cumsum([0] + num_periods).tolist()
+    return [periods_data[start:end] for start, end in zip(offsets[:-1], offsets[1:])]
+
+
+def get_households_summary(names: list[str], results: list[dict]) -> list[dict]:
+    """
+    Returns:
+        One row per household with its consumption and the best tariff of
+        the whole period
+    """
+
+    summary = []
+    for name, result in zip(names, results):
+        period = result["all"]
+        best_tariff = period["tariffs"][0]
+        summary.append({
+            "file": name,
+            "id": result.get("id"),
+            "contracted_p1": result.get("contracted_p1"),
+            "contracted_p2": result.get("contracted_p2"),
+            "first_day": period["first_day"],
+            "last_day": period["last_day"],
+            "num_days": period["consumption_data"]["num_days"],
+            "total_consumption": sum(
+                period["consumption_data"][field]
+                for field in ("consumption_p1", "consumption_p2", "consumption_p3")),
+            "best_tariff": best_tariff["name"],
+            "best_tariff_cost": best_tariff["tariff_cost"],
+            # Savings of the best tariff over the second best
+            "best_tariff_margin": (
+                period["tariffs"][1]["tariff_cost_diff"] if len(period["tariffs"]) > 1 else None),
+        })
+    return summary
+
+
+def check_grid_size(*steps: int):
+    """
+    Checks the number of points of a what-if grid, before building it.
+    Raises:
+        ValueError: if the grid is empty or bigger than WHAT_IF_MAX_POINTS
+    """
+
+    num_points = math.prod(steps)
+    if min(steps) < 1 or num_points > WHAT_IF_MAX_POINTS:
+        raise ValueError(
+            f"The grid has {num_points} points, it must have from 1 to {WHAT_IF_MAX_POINTS}")
+
+
+def get_grid_axis(name: str, start: float, stop: float | None, steps: int) -> np.ndarray:
+    """
+    Evenly spaced values from start to stop, both included.
+    Raises:
+        ValueError: if the range is not valid
+    """
+
+    stop = start if stop is None else stop
+    if steps < 1 or stop < start or (steps == 1 and stop != start):
+        raise ValueError(f"Invalid {name} range: {start} to {stop} in {steps} steps")
+    return np.linspace(start, stop, steps)
+
+
+def get_cheapest_tariffs(
+    consumption: DataConsumption,
+    contracted_p1: np.ndarray,
+    contracted_p2: np.ndarray,
+    rd_10_prices: np.ndarray,
+    tariffs: TariffsMatrix,
+    hourly_costs: np.ndarray | None = None,
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Cheapest tariff of a consumption period at every point of the grid of
+    contracted powers and RD10 prices.
+    The costs are linear in the contracted powers and the RD10 price, so the
+    tariffs are priced once at the origin and once with each of them set to
+    one, and the cost surface of the whole grid is the costs at the origin
+    plus the grid points times the slopes. It is evaluated in chunks of
+    points to bound the memory used.
+    Returns:
+        The index of the cheapest tariff at each point and its cost, with
+        shape (len(contracted_p1), len(contracted_p2), len(rd_10_prices))
+    """
+
+    if not len(tariffs):
+        raise ValueError("There are no tariffs to compare")
+
+    # Rows: the origin and one unit step of each grid dimension
+    steps = np.vstack([np.zeros(3), np.eye(3)])
+    if hourly_costs is not None:
+        hourly_costs = np.broadcast_to(
+            np.reshape(hourly_costs, (1, -1)), (len(steps), np.size(hourly_costs)))
+    costs = get_tariffs_costs(
+        steps[:, 0], steps[:, 1], [consumption] * len(steps), steps[:, 2], tariffs, hourly_costs
+    ).total_cost
+    origin = costs[0]
+    slopes = costs[1:] - origin
+
+    grid = np.stack(
+        np.meshgrid(contracted_p1, contracted_p2, rd_10_prices, indexing="ij"), axis=-1
+    ).reshape(-1, 3)
+    cheapest_tariff = np.empty(len(grid), dtype=np.intp)
+    cheapest_cost = np.empty(len(grid), dtype=np.float64)
+    chunk_size = max(1, WHAT_IF_CHUNK_SIZE // len(tariffs))
+    for start in range(0, len(grid), chunk_size):
+        points = grid[start:start + chunk_size]
+        surface = points @ slopes + origin
+        best = surface.argmin(axis=1)
+        cheapest_tariff[start:start + len(points)] = best
+        cheapest_cost[start:start + len(points)] = surface[np.arange(len(points)), best]
+
+    shape = (len(contracted_p1), len(contracted_p2), len(rd_10_prices))
+    return cheapest_tariff.reshape(shape), cheapest_cost.reshape(shape)
+
+
+def get_what_if_data(
+    consumption: DataConsumption,
+    contracted_p1: np.ndarray,
+    contracted_p2: np.ndarray,
+    rd_10_prices: np.ndarray,
+    tariffs: TariffsMatrix,
+    hourly_costs: np.ndarray | None = None,
+) -> dict:
+    """
+    Returns:
+        The cheapest tariff, as an index of tariff_names, and its cost for
+        every contracted_p1, contracted_p2 and RD10 price of the grid, as
+        nested lists in that order
+    """
+
+    check_grid_size(len(contracted_p1), len(contracted_p2), len(rd_10_prices))
+
+    cheapest_tariff, cheapest_cost = get_cheapest_tariffs(
+        consumption, contracted_p1, contracted_p2, rd_10_prices, tariffs, hourly_costs)
+
+    return {
+        "consumption_data": consumption.__dict__,
+        "contracted_p1": contracted_p1.tolist(),
+        "contracted_p2": contracted_p2.tolist(),
+        "rd_10_prices": rd_10_prices.tolist(),
+        "tariff_names": tariffs.names,
+        "cheapest_tariff": cheapest_tariff.tolist(),
+        "cheapest_cost": cheapest_cost.tolist(),
+    }
 
 
 def get_data(
@@ -310,35 +1007,14 @@ def get_data(
     contracted_p1: float,
     contracted_p2: float,
     rd_10_mean_price: float,
-    tariffs: list[TariffData]
+    tariffs: TariffsMatrix,
+    hourly_prices: list[HourlyPrices] = (),
 ) -> dict:
-    consumption_data = get_periods_consumption(df)
-
-    tariffs_costs = get_tariffs_costs(
-        contracted_p1, contracted_p2, consumption_data, rd_10_mean_price, tariffs
-    )
-
-    data = {
-        "consumption_data": consumption_data.__dict__,
-        "tariffs": [],
-        "first_day": df.iloc[0].Fecha,
-        "last_day": df.iloc[-1].Fecha,
-    }
-    # Print the results ordered by energy cost
-    bestTariffCost = tariffs_costs[0][1]
-    for tariff_name, tariff_cost in tariffs_costs:
-        tariff_cost_diff = tariff_cost - bestTariffCost
-        data["tariffs"].append(
-            {"name": tariff_name,
-             "tariff_cost": tariff_cost,
-             "tariff_cost_diff": tariff_cost_diff})
-
-    th_rd_10_threshold = get_rd_10_threshold(
-        contracted_p1, contracted_p2, consumption_data, tariffs_costs, rd_10_mean_price, tariffs
-    )
-    data["th_rd_10_threshold"] = th_rd_10_threshold
+    total_consumption = get_total_consumption(get_months_consumption(df, hourly_prices))
+    return get_periods_data(
+        total_consumption, contracted_p1, contracted_p2, rd_10_mean_price, tariffs
+    )[0]
 
-    return data
 
 @dataclass
 class GasDataConsumption:
@@ -346,28 +1022,262 @@ class GasDataConsumption:
     time: datetime
 
 
+GAS_MONITOR_COST_PER_DAY = 0.019068  # €
+GAS_TAX_COST = 0.002340  # €/kWh
+GAS_GENERAL_TAX = 5  # %
+m3_to_kWh = 10.579
+
+
+@dataclass(frozen=True)
+class GasTariffData:
+    name: str
+    fixed_cost_per_day: float  # €/day
+    energy_cost: float  # €/kWh
+
+
+# Regulated tariff used to price the readings of the users
+TUR_GAS_TARIFF = GasTariffData(
+    name="TUR 1",
+    fixed_cost_per_day=0.165370,
+    energy_cost=0.063555,
+)
+
+
+@dataclass(frozen=True)
+class GasTariffsMatrix:
+    """
+    Columnar view of a gas tariffs catalog, one entry per tariff, so every
+    tariff can be priced at once with array operations.
+    """
+
+    names: list[str]
+    fixed_costs: np.ndarray  # €/day, shape (tariffs,)
+    energy_costs: np.ndarray  # €/kWh, shape (tariffs,)
+
+    @classmethod
+    def from_tariffs(cls, tariffs: list[GasTariffData]) -> "GasTariffsMatrix":
+        return cls(
+            names=[t.name for t in tariffs],
+            fixed_costs=np.array(
+                [t.fixed_cost_per_day for t in tariffs], dtype=np.float64),
+            energy_costs=np.array(
+                [t.energy_cost for t in tariffs], dtype=np.float64),
+        )
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+
 def calculate_gas_cost(
     consumptionA: GasDataConsumption,
     consumptionB: GasDataConsumption,
+    tariff: GasTariffData = TUR_GAS_TARIFF,
 ) -> float:
 
-    FIXED_COST_PER_DAY = 0.165370  # €
-    MONITOR_COST_PER_DAY = 0.019068  # €
-    TUR_TARIFF_COST = 0.063555  # €/kWh
-    GAS_TAX_COST = 0.002340  # €/kWh
-    TAX_COST = 5  # %
-    m3_to_kWh = 10.579
-
     num_days = max((consumptionB.time - consumptionA.time).days, 1)
 
     energy_consumption = (consumptionB.measurement -
                           consumptionA.measurement) * m3_to_kWh
 
-    energy_monitor_cost = MONITOR_COST_PER_DAY * num_days
-    fixed_cost = FIXED_COST_PER_DAY * num_days
+    energy_monitor_cost = GAS_MONITOR_COST_PER_DAY * num_days
+    fixed_cost = tariff.fixed_cost_per_day * num_days
+
+    tax = GAS_TAX_COST * energy_consumption
+    energy_cost = tariff.energy_cost * energy_consumption
+
+    gas_cost = energy_monitor_cost + fixed_cost + tax + energy_cost
+    return gas_cost * (1 + GAS_GENERAL_TAX / 100)
+
+
+def get_gas_num_days(times_a: np.ndarray, times_b: np.ndarray) -> np.ndarray:
+    return np.maximum((times_b - times_a) // np.timedelta64(1, "D"), 1)
+
+
+def get_gas_tariffs_costs(
+    measurements_a: np.ndarray,
+    times_a: np.ndarray,
+    measurements_b: np.ndarray,
+    times_b: np.ndarray,
+    tariffs: GasTariffsMatrix,
+) -> np.ndarray:
+    """
+    Gas costs of every pair of readings (a, b) against every tariff, the
+    same math as calculate_gas_cost.
+    Returns:
+        Costs matrix of shape (pairs, tariffs)
+    """
+
+    num_days = get_gas_num_days(times_a, times_b).reshape(-1, 1)
+
+    energy_consumption = (
+        (measurements_b - measurements_a) * m3_to_kWh).reshape(-1, 1)
+
+    energy_monitor_cost = GAS_MONITOR_COST_PER_DAY * num_days
+    fixed_cost = num_days * tariffs.fixed_costs
 
     tax = GAS_TAX_COST * energy_consumption
-    energy_cost = TUR_TARIFF_COST * energy_consumption
+    energy_cost = energy_consumption * tariffs.energy_costs
 
     gas_cost = energy_monitor_cost + fixed_cost + tax + energy_cost
-    return gas_cost * (1 + TAX_COST / 100)
+    return gas_cost * (1 + GAS_GENERAL_TAX / 100)
+
+
+def calculate_gas_costs(
+    measurements_a: np.ndarray,
+    times_a: np.ndarray,
+    measurements_b: np.ndarray,
+    times_b: np.ndarray,
+    tariff: GasTariffData = TUR_GAS_TARIFF,
+) -> np.ndarray:
+    """
+    Vectorized calculate_gas_cost, prices every pair of readings (a, b) at once.
+    """
+
+    return get_gas_tariffs_costs(
+        measurements_a, times_a, measurements_b, times_b,
+        GasTariffsMatrix.from_tariffs([tariff]),
+    )[:, 0]
+
+
+def get_periods_readings(
+    times: np.ndarray, unit: str
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Readings each period with readings is priced between: the last reading
+    at or before its start and the last one at or before its end. The
+    consumption between readings of different periods goes to the period of
+    the later reading, so the costs of the periods add up to the whole.
+    Returns:
+        The periods, and the positions of their first and last readings
+    """
+
+    periods = np.unique(times.astype(f"datetime64[{unit}]"))
+    first = np.searchsorted(times, periods.astype(times.dtype), side="right") - 1
+    last = np.searchsorted(times, (periods + 1).astype(times.dtype), side="right") - 1
+    # The first period starts at the first reading
+    return periods, np.maximum(first, 0), last
+
+
+def get_gas_cost_series(measurements: pd.DataFrame) -> dict:
+    """
+    Gas costs between consecutive readings and of every day and month, as
+    columns ready to be charted. The daily and monthly costs are priced
+    between the readings returned by get_periods_readings.
+    """
+
+    times = measurements.index.to_numpy().astype("datetime64[us]")
+    values = measurements.Measurement.to_numpy(dtype=np.float64)
+
+    series = {
+        "intervals": {
+            "start": times[:-1].tolist(),
+            "end": times[1:].tolist(),
+            "cost": calculate_gas_costs(
+                values[:-1], times[:-1], values[1:], times[1:]).tolist(),
+        }
+    }
+    for name, unit in (("daily", "D"), ("monthly", "M")):
+        periods, starts, ends = get_periods_readings(times, unit)
+        series[name] = {
+            "start": periods.tolist(),
+            "cost": calculate_gas_costs(
+                values[starts], times[starts], values[ends], times[ends]).tolist(),
+        }
+    return series
+
+
+def get_gas_tariffs_comparison(measurements: pd.DataFrame, tariffs: GasTariffsMatrix) -> dict:
+    """
+    Compares the gas tariffs over every month of the readings and over the
+    whole history, pricing all of them at once. Each month is priced between
+    the readings returned by get_periods_readings, and its tariffs are
+    ordered by cost like in get_periods_data.
+    """
+
+    times = measurements.index.to_numpy().astype("datetime64[us]")
+    values = measurements.Measurement.to_numpy(dtype=np.float64)
+    if len(times) < 2:
+        return {}
+
+    _, starts, ends = get_periods_readings(times, "M")
+    # The last period is the whole history
+    starts = np.r_[starts, 0]
+    ends = np.r_[ends, len(times) - 1]
+
+    costs = get_gas_tariffs_costs(
+        values[starts], times[starts], values[ends], times[ends], tariffs)
+    rankings = np.argsort(costs, axis=1, kind="stable")
+    consumptions = (values[ends] - values[starts]) * m3_to_kWh
+    num_days = get_gas_num_days(times[starts], times[ends])
+
+    periods_data = []
+    for first_day, last_day, consumption, days, period_costs, ranking in zip(
+        times[starts].tolist(),
+        times[ends].tolist(),
+        consumptions.tolist(),
+        num_days.tolist(),
+        costs.tolist(),
+        rankings.tolist(),
+    ):
+        best_tariff_cost = period_costs[ranking[0]]
+        periods_data.append({
+            "consumption": consumption,  # kWh
+            "num_days": days,
+            "tariffs": [
+                {"name": tariffs.names[tariff_index],
+                 "tariff_cost": period_costs[tariff_index],
+                 "tariff_cost_diff": period_costs[tariff_index] - best_tariff_cost}
+                for tariff_index in ranking
+            ],
+            "first_day": first_day,
+            "last_day": last_day,
+        })
+
+    return {"monthly_data": periods_data[:-1], "all": periods_data[-1]}
+
+
+def read_gas_measurements(file: BinaryIO) -> pd.DataFrame:
+    """
+    Reads a csv with the columns Datetime and Measurement (m3), separated by
+    commas or by semicolons with decimal commas.
+    """
+
+    header = file.readline().decode("utf-8-sig")
+    file.seek(0)
+    sep, decimal = (";", ",") if ";" in header else (",", ".")
+
+    df = pd.read_csv(
+        file, sep=sep, decimal=decimal, usecols=["Datetime", "Measurement"],
+        dtype={"Measurement": np.float64},
+    )
+    df.Datetime = pd.to_datetime(df.Datetime)
+    return df.set_index("Datetime").sort_index()
+
+
+def get_gas_costs(store, user_id: int, now: datetime) -> dict:
+    """
+    Gas cost since the previous reading and in the today, this week, this
+    month and last 30 days windows, from the rollups of a GasMeasurementsStore.
+    """
+
+    last_readings = store.get_last_readings(user_id, 2)
+    if len(last_readings) < 2:
+        return {}
+
+    def window_cost(first_day: date, last_day: date) -> float | None:
+        readings = store.get_window_readings(user_id, first_day, last_day)
+        if readings is None:
+            return None
+        return calculate_gas_cost(*readings)
+
+    today = now.date()
+    month_start = today.replace(day=1)
+    month_end = today.replace(day=calendar.monthrange(today.year, today.month)[1])
+
+    return {"cost_since_last": calculate_gas_cost(*last_readings),
+            "last_measurement": last_readings[0].time,
+            "cost_today": window_cost(today, today),
+            "cost_this_week": window_cost(today - timedelta(days=7), today),
+            "cost_this_month": window_cost(month_start, month_end),
+            "cost_last_30days": window_cost(month_start - timedelta(days=30), today),
+            }
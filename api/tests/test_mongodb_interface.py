@@ -0,0 +1,167 @@
+"""
+Tests of the write-behind writer and the upload results lookups of
+mongodb_interface, against mongomock.
+
+Run from the api directory:
+    python -m pytest tests
+"""
+
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+import bson
+import mongomock
+from bson.objectid import ObjectId
+from pymongo.errors import AutoReconnect
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "source"))
+
+import mongodb_interface as dbinterface  # noqa: E402
+
+COLLECTION = "documents"
+
+
+class WriteBehindWriterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.db = mongomock.MongoClient()["data"]
+        patcher = mock.patch.object(dbinterface, "_db", self.db)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.pending_file = os.path.join(directory.name, "pending.bson")
+
+        self.writer = dbinterface.WriteBehindWriter(
+            batch_size=3, interval=0.01, pending_file=self.pending_file)
+        self.addCleanup(self.writer.stop)
+
+    def put(self, documents, collection_name=COLLECTION):
+        # Queue the documents without the writer thread, the tests flush them
+        with mock.patch.object(self.writer, "start"):
+            for document in documents:
+                self.writer.put(collection_name, document)
+
+    def flush(self):
+        while not self.writer._queue.empty():
+            self.writer._write_batch()
+
+    def stored_ids(self, collection_name=COLLECTION):
+        return {document["_id"] for document in self.db[collection_name].find()}
+
+    def test_batches_insert_many(self):
+        documents = [{"_id": ObjectId(), "value": i} for i in range(7)]
+        self.put(documents)
+
+        with mock.patch.object(
+                dbinterface, "insertDocuments", wraps=dbinterface.insertDocuments) as insert:
+            self.flush()
+
+        self.assertEqual([len(call.args[1]) for call in insert.call_args_list], [3, 3, 1])
+        self.assertEqual(self.stored_ids(), {document["_id"] for document in documents})
+
+    def test_groups_batches_by_collection(self):
+        self.put([{"_id": ObjectId()}], "a")
+        self.put([{"_id": ObjectId()}], "b")
+        self.flush()
+
+        self.assertEqual(len(self.stored_ids("a")), 1)
+        self.assertEqual(len(self.stored_ids("b")), 1)
+
+    def test_reads_documents_before_they_are_stored(self):
+        document = {"_id": ObjectId(), "value": 1}
+        self.put([document])
+
+        self.assertEqual(self.writer.get(COLLECTION, document["_id"]), document)
+        self.assertEqual(self.stored_ids(), set())
+
+        self.flush()
+        self.assertIsNone(self.writer.get(COLLECTION, document["_id"]))
+        self.assertEqual(self.stored_ids(), {document["_id"]})
+
+    def test_get_energy_document_before_it_is_stored(self):
+        with mock.patch.object(dbinterface, "writer", self.writer), \
+                mock.patch.object(dbinterface, "WRITE_BEHIND", True), \
+                mock.patch.object(self.writer, "start"):
+            document = {"_id": ObjectId(), "format": 2}
+            dbinterface.insertDocument(dbinterface.ENERGY_DATA_COLLECTION, document)
+
+            self.assertEqual(dbinterface.getEnergyDocument(str(document["_id"])), document)
+            self.assertEqual(self.stored_ids(dbinterface.ENERGY_DATA_COLLECTION), set())
+
+    def test_saves_pending_file_when_mongodb_is_unavailable(self):
+        documents = [{"_id": ObjectId(), "value": i} for i in range(2)]
+        self.put(documents)
+
+        with mock.patch.object(dbinterface, "insertDocuments", side_effect=AutoReconnect()):
+            self.flush()
+
+        with open(self.pending_file, "rb") as f:
+            records = list(bson.decode_file_iter(f))
+        self.assertEqual(records, [{"collection": COLLECTION, "document": document}
+                                   for document in documents])
+        self.assertEqual(self.stored_ids(), set())
+        # They are no longer served from memory once they are saved
+        self.assertIsNone(self.writer.get(COLLECTION, documents[0]["_id"]))
+
+    def test_replays_pending_file(self):
+        documents = [{"_id": ObjectId(), "value": i} for i in range(5)]
+        self.put(documents)
+        with mock.patch.object(dbinterface, "insertDocuments", side_effect=AutoReconnect()):
+            self.flush()
+
+        self.writer._write_pending_file()
+
+        self.assertEqual(self.stored_ids(), {document["_id"] for document in documents})
+        self.assertFalse(os.path.exists(self.pending_file))
+
+    def test_replay_ignores_duplicate_keys(self):
+        documents = [{"_id": ObjectId(), "value": i} for i in range(3)]
+        self.put(documents)
+        with mock.patch.object(dbinterface, "insertDocuments", side_effect=AutoReconnect()):
+            self.flush()
+        # Stored by a previous replay that did not finish
+        self.db[COLLECTION].insert_one(documents[0])
+
+        self.writer._write_pending_file()
+
+        self.assertEqual(self.stored_ids(), {document["_id"] for document in documents})
+        self.assertFalse(os.path.exists(self.pending_file))
+
+    def test_stop_stores_queued_documents(self):
+        documents = [{"_id": ObjectId(), "value": i} for i in range(10)]
+        for document in documents:
+            self.writer.put(COLLECTION, document)
+        self.writer.stop()
+
+        self.assertEqual(self.stored_ids(), {document["_id"] for document in documents})
+
+
+class UploadResultsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.db = mongomock.MongoClient()["data"]
+        patcher = mock.patch.object(dbinterface, "_db", self.db)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_finds_stored_results(self):
+        self.db[dbinterface.UPLOAD_COLLECTION].insert_one({"_id": "key", "energy_data_id": "id"})
+
+        self.assertEqual(dbinterface.getUploadResult("key"), "id")
+        self.assertIsNone(dbinterface.getUploadResult("other"))
+        self.assertEqual(dbinterface.getUploadResults(["key", "other"]), {"key": "id"})
+
+    def test_misses_when_mongodb_is_unavailable(self):
+        with mock.patch.object(
+                mongomock.collection.Collection, "find", side_effect=AutoReconnect()):
+            self.assertIsNone(dbinterface.getUploadResult("key"))
+            self.assertEqual(dbinterface.getUploadResults(["key"]), {})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,121 @@
+"""
+Tests of the vectorized tariffs pricing of utils, against the scalar
+TariffData.calculate_electricity_cost.
+
+Run from the api directory:
+    python -m pytest tests
+"""
+
+import dataclasses
+import os
+import sys
+import unittest
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "source"))
+
+import tariffs_data  # noqa: E402
+import utils  # noqa: E402
+
+RD_10_MEAN_PRICE = 0.1
+
+
+def get_catalog() -> list[utils.TariffData]:
+    # The shipped tariffs do not include the RD10, add some that do
+    tariffs = [tariff for tariff in tariffs_data.tariffs if tariff.price_series is None]
+    return tariffs + [
+        dataclasses.replace(
+            tariff, name=f"{tariff.name} RD10", rd_10_included=True,
+            energy_cost_p1=tariff.energy_cost_p1 + 0.09 + 0.01 * i,
+            energy_cost_p2=tariff.energy_cost_p2 + 0.09 + 0.01 * i,
+            energy_cost_p3=tariff.energy_cost_p3 + 0.09 + 0.01 * i)
+        for i, tariff in enumerate(tariffs[:3])
+    ]
+
+
+def get_rd_10_threshold(tariffs, consumption, contracted_p1, contracted_p2):
+    """RD10 threshold of a period, from the scalar costs of the tariffs."""
+    costs = {tariff.name: tariff.calculate_electricity_cost(
+        consumption, contracted_p1, contracted_p2, RD_10_MEAN_PRICE) for tariff in tariffs}
+    best_rd_tariff = min((t for t in tariffs if t.rd_10_included), key=lambda t: costs[t.name].total_cost)
+    best_non_rd_tariff = min(
+        (t for t in tariffs if not t.rd_10_included), key=lambda t: costs[t.name].total_cost)
+    return (
+        costs[best_rd_tariff.name].cost_without_taxes
+        - costs[best_non_rd_tariff.name].energy_cost
+        - costs[best_non_rd_tariff.name].power_cost
+    ) / consumption.total_consumption
+
+
+class TariffsCostsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tariffs = get_catalog()
+        self.matrix = utils.TariffsMatrix.from_tariffs(self.tariffs)
+
+        rng = np.random.default_rng(0)
+        self.consumptions = [
+            utils.DataConsumption(
+                consumption_p1=float(p1), consumption_p2=float(p2),
+                consumption_p3=float(p3), num_days=int(num_days))
+            for p1, p2, p3, num_days in zip(
+                rng.uniform(0, 400, 24), rng.uniform(0, 400, 24), rng.uniform(1, 600, 24),
+                rng.integers(1, 32, 24))
+        ]
+        # A whole period, and the extra hour of a DST change day
+        self.consumptions.append(utils.DataConsumption(
+            consumption_p1=2400.5, consumption_p2=3100.25, consumption_p3=5200.75, num_days=731))
+        self.consumptions.append(utils.DataConsumption(
+            consumption_p1=0.0, consumption_p2=0.0, consumption_p3=12.5, num_days=1))
+
+    def assert_costs(self, costs, contracted_p1, contracted_p2):
+        for row, consumption in enumerate(self.consumptions):
+            for column, tariff in enumerate(self.tariffs):
+                expected = tariff.calculate_electricity_cost(
+                    consumption, contracted_p1[row], contracted_p2[row], RD_10_MEAN_PRICE)
+                for field in ("energy_cost", "power_cost", "rd_10_cost", "total_cost"):
+                    self.assertAlmostEqual(
+                        getattr(costs, field)[row, column], getattr(expected, field), delta=1e-9,
+                        msg=f"{field} of {tariff.name} in period {row}")
+                self.assertAlmostEqual(
+                    costs.cost_without_taxes[row, column], expected.cost_without_taxes, delta=1e-9)
+
+    def test_costs_match_scalar_pricing(self):
+        costs = utils.get_tariffs_costs(3.3, 4.4, self.consumptions, RD_10_MEAN_PRICE, self.matrix)
+
+        num_periods = len(self.consumptions)
+        self.assertEqual(costs.total_cost.shape, (num_periods, len(self.tariffs)))
+        self.assert_costs(costs, [3.3] * num_periods, [4.4] * num_periods)
+
+    def test_costs_with_contracted_powers_of_each_period(self):
+        contracted_p1 = np.linspace(2.0, 6.0, len(self.consumptions))
+        contracted_p2 = np.linspace(7.0, 3.0, len(self.consumptions))
+        costs = utils.get_tariffs_costs(
+            contracted_p1, contracted_p2, self.consumptions, RD_10_MEAN_PRICE, self.matrix)
+
+        self.assert_costs(costs, contracted_p1, contracted_p2)
+
+    def test_rd_10_thresholds_match_scalar_pricing(self):
+        self.assertTrue(self.matrix.rd_10_included.any())
+        self.assertFalse(self.matrix.rd_10_included.all())
+
+        costs = utils.get_tariffs_costs(3.3, 4.4, self.consumptions, RD_10_MEAN_PRICE, self.matrix)
+        thresholds = utils.get_rd_10_thresholds(costs, self.consumptions, self.matrix)
+
+        for consumption, threshold in zip(self.consumptions, thresholds):
+            self.assertAlmostEqual(
+                threshold, get_rd_10_threshold(self.tariffs, consumption, 3.3, 4.4), delta=1e-12)
+
+    def test_no_rd_10_thresholds_with_a_single_kind_of_tariffs(self):
+        matrix = utils.TariffsMatrix.from_tariffs(
+            [tariff for tariff in self.tariffs if not tariff.rd_10_included])
+        costs = utils.get_tariffs_costs(3.3, 4.4, self.consumptions, RD_10_MEAN_PRICE, matrix)
+
+        self.assertEqual(
+            utils.get_rd_10_thresholds(costs, self.consumptions, matrix),
+            [None] * len(self.consumptions))
+
+
+if __name__ == "__main__":
+    unittest.main()
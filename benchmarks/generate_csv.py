@@ -0,0 +1,124 @@
+"""
+Generates synthetic distributor csv files, with the same layout as the files
+downloaded from the distributors:
+
+    CUPS;Fecha;Hora;Consumo_kWh;Metodo_obtencion
+    ES0000000000000000XX0F;01/01/2022;1;0,312;R
+
+The hours go from 1 to 24, with 23 and 25 hours on the days of the time
+change. Quarter hourly files repeat every hour four times, each row with a
+quarter of the hour consumption.
+
+Usage:
+    python generate_csv.py output.csv --months 12 --resolution quarter-hourly --column AE_kWh
+"""
+
+import argparse
+from datetime import date, datetime, timedelta
+from zoneinfo import ZoneInfo
+
+import numpy as np
+import pandas as pd
+
+ENERGY_COLUMNS = ("Consumo_kWh", "AE_kWh")
+RESOLUTIONS = {"hourly": 1, "quarter-hourly": 4}
+CUPS = "ES0000000000000000XX0F"
+TIMEZONE = ZoneInfo("Europe/Madrid")
+
+# Mean consumption of each hour of the day (kWh), with the morning and
+# evening peaks of a household
+HOURLY_PROFILE = np.array([
+    0.20, 0.16, 0.14, 0.13, 0.13, 0.15, 0.22, 0.35,
+    0.40, 0.30, 0.26, 0.25, 0.30, 0.38, 0.34, 0.26,
+    0.24, 0.28, 0.36, 0.48, 0.56, 0.58, 0.46, 0.30,
+])
+
+
+def add_months(day: date, months: int) -> date:
+    month = day.month - 1 + months
+    return date(day.year + month // 12, month % 12 + 1, 1)
+
+
+def get_day_hours(day: date) -> int:
+    """Number of hours of a day in Spain, 23 or 25 on the days of the time change."""
+    start = datetime(day.year, day.month, day.day, tzinfo=TIMEZONE)
+    end = start + timedelta(days=1)
+    return int((end.timestamp() - start.timestamp()) // 3600)
+
+
+def generate_dataframe(
+    months: int,
+    resolution: str = "hourly",
+    energy_column: str = "Consumo_kWh",
+    start: date = date(2022, 1, 1),
+    seed: int = 0,
+) -> pd.DataFrame:
+    if energy_column not in ENERGY_COLUMNS:
+        raise ValueError(f"Unknown energy column: {energy_column}")
+    rows_per_hour = RESOLUTIONS[resolution]
+    rng = np.random.default_rng(seed)
+
+    days = pd.date_range(start, add_months(start, months), freq="D", inclusive="left")
+    day_hours = np.array([get_day_hours(day) for day in days.date])
+
+    # One row per hour of every day
+    day_index = np.repeat(np.arange(len(days)), day_hours)
+    hours = np.concatenate([np.arange(1, n + 1) for n in day_hours])
+
+    # Hourly profile, more consumption on weekends and in winter and summer
+    weekend = days.dayofweek.to_numpy()[day_index] >= 5
+    season = 1 + 0.35 * np.cos(2 * np.pi * (days.dayofyear.to_numpy()[day_index] - 15) / 182.5)
+    consumption = (
+        HOURLY_PROFILE[np.minimum(hours, 24) - 1]
+        * np.where(weekend, 1.2, 1.0)
+        * season
+        * rng.lognormal(0.0, 0.35, len(hours))
+    )
+
+    # Quarter hourly files repeat each hour, with a quarter of the consumption
+    day_index = np.repeat(day_index, rows_per_hour)
+    hours = np.repeat(hours, rows_per_hour)
+    consumption = np.repeat(consumption / rows_per_hour, rows_per_hour)
+
+    return pd.DataFrame({
+        "CUPS": CUPS,
+        "Fecha": days.strftime("%d/%m/%Y").to_numpy()[day_index],
+        "Hora": hours,
+        energy_column: consumption.round(3),
+        "Metodo_obtencion": "R",
+    })
+
+
+def generate_csv(
+    path,
+    months: int,
+    resolution: str = "hourly",
+    energy_column: str = "Consumo_kWh",
+    start: date = date(2022, 1, 1),
+    seed: int = 0,
+):
+    """Writes a synthetic distributor csv to a path or a binary file."""
+    df = generate_dataframe(months, resolution, energy_column, start, seed)
+    content = df.to_csv(sep=";", decimal=",", index=False, float_format="%.3f")
+    if hasattr(path, "write"):
+        path.write(content.encode("utf-8"))
+    else:
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(content)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generates a synthetic distributor csv file")
+    parser.add_argument("output")
+    parser.add_argument("--months", type=int, default=12)
+    parser.add_argument("--resolution", choices=RESOLUTIONS, default="hourly")
+    parser.add_argument("--column", choices=ENERGY_COLUMNS, default="Consumo_kWh")
+    parser.add_argument("--start", type=date.fromisoformat, default=date(2022, 1, 1))
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    generate_csv(args.output, args.months, args.resolution, args.column, args.start, args.seed)
+
+
+if __name__ == "__main__":
+    main()
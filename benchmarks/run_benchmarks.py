@@ -0,0 +1,224 @@
+"""
+Micro-benchmarks of the parse and price pipeline of the uploads.
+
+Times get_dataframe, get_periods_consumption, get_tariffs_costs, get_data,
+get_upload_data (the pipeline run by /file-upload) and get_cheapest_tariffs
+(the grid evaluation of /what-if) over synthetic distributor
+files of several sizes, resolutions and energy columns, and catalogs of
+several sizes. The results are written as JSON, and when a baseline results
+file is given the run fails if any benchmark is slower than allowed.
+
+Usage:
+    python run_benchmarks.py --output results.json
+    python run_benchmarks.py --output new.json --baseline results.json --max-regression 0.2
+
+The holidays of the province are downloaded on the first run and cached in
+api/source/cache, like the API does.
+"""
+
+import argparse
+import io
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+from dataclasses import replace
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from generate_csv import ENERGY_COLUMNS, RESOLUTIONS, generate_csv
+
+SOURCE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "api", "source")
+
+CONTRACTED_P1 = 4.6  # kW
+CONTRACTED_P2 = 4.6  # kW
+RD_10_MEAN_PRICE = 0.1  # €/kWh
+CATALOG_SIZES = (16, 100, 1000)
+MONTHS = (1, 12, 120)
+QUICK_MONTHS = (1, 12)
+# Points of each dimension of the what-if grids: contracted_p1, contracted_p2, RD10 price
+WHAT_IF_GRIDS = ((10, 10, 10), (40, 40, 60))
+
+
+def get_catalog(tariffs: list, size: int, seed: int = 0) -> list:
+    """Catalog of the given size made of copies of the real tariffs with perturbed prices."""
+    rng = np.random.default_rng(seed)
+    catalog = []
+    for i in range(size):
+        tariff = tariffs[i % len(tariffs)]
+        if i >= len(tariffs):
+            factors = rng.uniform(0.8, 1.2, 5)
+            tariff = replace(
+                tariff,
+                name=f"{tariff.name} {i}",
+                energy_cost_p1=tariff.energy_cost_p1 * factors[0],
+                energy_cost_p2=tariff.energy_cost_p2 * factors[1],
+                energy_cost_p3=tariff.energy_cost_p3 * factors[2],
+                power_cost_p1=tariff.power_cost_p1 * factors[3],
+                power_cost_p2=tariff.power_cost_p2 * factors[4],
+            )
+        catalog.append(tariff)
+    return catalog
+
+
+def measure(func, repeat: int) -> dict:
+    # The first call warms up the caches and is not measured
+    func()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return {
+        "min": min(times),
+        "median": statistics.median(times),
+        "mean": statistics.fmean(times),
+        "repeat": repeat,
+    }
+
+
+def get_name(benchmark: str, params: dict) -> str:
+    return f"{benchmark}[{','.join(f'{key}={value}' for key, value in params.items())}]"
+
+
+def run_benchmarks(repeat: int, months_sizes: tuple, resolutions: tuple, columns: tuple) -> dict:
+    import tariffs_data
+    import utils
+
+    results = {}
+
+    def run(benchmark: str, params: dict, func):
+        name = get_name(benchmark, params)
+        result = measure(func, repeat)
+        results[name] = {"benchmark": benchmark, "params": params, **result}
+        print(f"{name:<90} {result['median'] * 1000:10.2f} ms", flush=True)
+
+    matrices = {
+        size: utils.TariffsMatrix.from_tariffs(get_catalog(tariffs_data.tariffs, size))
+        for size in CATALOG_SIZES
+    }
+
+    for months in months_sizes:
+        for resolution in resolutions:
+            for column in columns:
+                file = io.BytesIO()
+                generate_csv(file, months, resolution, column)
+                content = file.getvalue()
+                params = {"months": months, "resolution": resolution, "column": column}
+
+                def read():
+                    return utils.get_dataframe(io.BytesIO(content))
+
+                df = read()
+                run("get_dataframe", params, read)
+                run("get_periods_consumption", params,
+                    lambda: utils.get_periods_consumption(df))
+
+                for size, matrix in matrices.items():
+                    size_params = {**params, "tariffs": size}
+                    run("get_data", size_params, lambda: utils.get_data(
+                        df, CONTRACTED_P1, CONTRACTED_P2, RD_10_MEAN_PRICE, matrix))
+                    run("get_upload_data", size_params, lambda: utils.get_upload_data(
+                        content, len(content), utils.DEFAULT_PROVINCE,
+                        CONTRACTED_P1, CONTRACTED_P2, RD_10_MEAN_PRICE, matrix))
+
+    # Pricing only depends on the number of periods and tariffs
+    months_consumption = utils.get_months_consumption(df)
+    consumptions = [
+        utils.get_data_consumption(period) for _, period in pd.concat(
+            [months_consumption, utils.get_total_consumption(months_consumption)]).iterrows()
+    ]
+    for size, matrix in matrices.items():
+        run("get_tariffs_costs", {"periods": len(consumptions), "tariffs": size},
+            lambda: utils.get_tariffs_costs(
+                CONTRACTED_P1, CONTRACTED_P2, consumptions, RD_10_MEAN_PRICE, matrix))
+
+    for grid in WHAT_IF_GRIDS:
+        contracted_p1 = np.linspace(1.0, 10.0, grid[0])
+        contracted_p2 = np.linspace(1.0, 10.0, grid[1])
+        rd_10_prices = np.linspace(0.0, 0.2, grid[2])
+        for size, matrix in matrices.items():
+            run("get_cheapest_tariffs", {"points": int(np.prod(grid)), "tariffs": size},
+                lambda: utils.get_cheapest_tariffs(
+                    consumptions[-1], contracted_p1, contracted_p2, rd_10_prices, matrix))
+
+    return results
+
+
+def compare(results: dict, baseline: dict, max_regression: float) -> list[str]:
+    """
+    Returns:
+        The benchmarks whose median time grew more than max_regression
+        (a fraction) over the baseline
+    """
+    regressions = []
+    print(f"\n{'benchmark':<90} {'baseline':>10} {'current':>10} {'change':>8}")
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        baseline_median = baseline[name]["median"]
+        change = result["median"] / baseline_median - 1
+        flag = ""
+        if change > max_regression:
+            regressions.append(name)
+            flag = " REGRESSION"
+        print(f"{name:<90} {baseline_median * 1000:8.2f}ms {result['median'] * 1000:8.2f}ms "
+              f"{change:+7.1%}{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks the parse and price pipeline")
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--baseline", help="Results of a previous run to compare with")
+    parser.add_argument("--max-regression", type=float, default=0.2,
+                        help="Allowed growth of the median time over the baseline, as a fraction")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--quick", action="store_true",
+                        help="Only the hourly files of up to one year")
+    args = parser.parse_args()
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)["results"]
+    output = os.path.abspath(args.output)
+
+    # The API modules expect to run from their directory
+    sys.path.insert(0, SOURCE_DIR)
+    os.chdir(SOURCE_DIR)
+
+    results = run_benchmarks(
+        args.repeat,
+        QUICK_MONTHS if args.quick else MONTHS,
+        ("hourly",) if args.quick else tuple(RESOLUTIONS),
+        ENERGY_COLUMNS,
+    )
+
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump({
+            "metadata": {
+                "date": datetime.utcnow().isoformat(),
+                "python": platform.python_version(),
+                "numpy": np.__version__,
+                "pandas": pd.__version__,
+                "machine": platform.machine(),
+                "repeat": args.repeat,
+            },
+            "results": results,
+        }, f, indent=2)
+    print(f"\nResults written to {output}")
+
+    if baseline is not None:
+        regressions = compare(results, baseline, args.max_regression)
+        if regressions:
+            print(f"\n{len(regressions)} benchmarks are more than {args.max_regression:.0%} slower")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()